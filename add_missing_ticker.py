@@ -6,14 +6,23 @@ import requests
 import time
 import traceback
 from typing import Optional
-from src.gdrive_service import get_gdrive_service, find_id, upload_or_update_parquet
+from src.gdrive_service import get_gdrive_service, find_id
+from src.asi_recompute import ASI_DIRTY_RANGES_FILE_NAME, append_dirty_ranges
+from src.pipeline import run_pipeline, print_metrics
+from src.refresh_stages import make_refresh_stages
+from src.normalization import normalize_eod_json, to_bar_frame
+from src.universe_manifest import last_complete_day, clip_bars
 
 # --- CONFIGURAZIONE ---
 EODHD_API_KEY = os.getenv("EODHD_API_KEY")
 GDRIVE_SA_KEY = os.getenv("GDRIVE_SA_KEY")
 ROOT_FOLDER_NAME = "KriterionQuant_Data"
 RAW_HISTORY_FOLDER_NAME = "raw-history"
+PRODUCTION_FOLDER_NAME = "production"
 START_DATE = "2018-01-01"
+FETCH_WORKERS = 2
+TRANSFORM_WORKERS = 1
+UPLOAD_WORKERS = 2
 
 # --- TICKER DA FORZARE ---
 TICKERS_TO_FIX = [
@@ -21,36 +30,28 @@ TICKERS_TO_FIX = [
 ]
 
 def fetch_history_for_ticker(ticker: str, api_key: str, start_date: str) -> Optional[pd.DataFrame]:
-    url = f"https://eodhd.com/api/eod/{ticker}?api_token={api_key}&fmt=json&period=d&from={start_date}"
+    # Come nel refresh: solo giorni conclusi, la barra di oggi è parziale
+    end_date = last_complete_day()
+    url = f"https://eodhd.com/api/eod/{ticker}?api_token={api_key}&fmt=json&period=d&from={start_date}&to={end_date.strftime('%Y-%m-%d')}"
     print(f"Tentativo di download per {ticker}...")
     try:
         r = requests.get(url, timeout=60)
         r.raise_for_status()
-        data = r.json()
-        if not data:
+        try:
+            table = normalize_eod_json(r.content)
+        except ValueError as e:
+            print(f"  - Dati per {ticker} non validi: {e}")
+            return None
+        if table.num_rows == 0:
             print(f"  - L'API non ha restituito dati per {ticker}.")
             return None
         
-        df = pd.DataFrame(data)
-
-        final_data = {}
-        if 'date' not in df.columns: return None
-        final_data['date'] = df['date']
-        
-        if 'adjusted_close' in df.columns and df['adjusted_close'].notna().any():
-            final_data['close'] = df['adjusted_close']
-        elif 'close' in df.columns:
-            final_data['close'] = df['close']
-        else:
-            return None
-
-        if 'volume' in df.columns:
-            final_data['volume'] = df['volume']
-        else:
+        history_df = clip_bars(to_bar_frame(table), end_date)
+        if history_df.empty:
+            print(f"  - Nessuna barra completa per {ticker}.")
             return None
-        
         print(f"  - Dati per {ticker} scaricati e colonne verificate.")
-        return pd.DataFrame(final_data)
+        return history_df
 
     except requests.exceptions.RequestException as e:
         print(f"  - ERRORE API durante il download di {ticker}: {e}")
@@ -71,18 +72,37 @@ if __name__ == "__main__":
 
         raw_history_folder_id = find_id(gdrive_service, name=RAW_HISTORY_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
         if not raw_history_folder_id: raise FileNotFoundError(f"'{RAW_HISTORY_FOLDER_NAME}' non trovata.")
+        prod_folder_id = find_id(gdrive_service, name=PRODUCTION_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
         print("Cartelle trovate con successo.")
 
-        for ticker in TICKERS_TO_FIX:
-            print(f"\nProcesso di fix per: {ticker}")
-            history_df = fetch_history_for_ticker(ticker, EODHD_API_KEY, START_DATE)
-
-            if history_df is not None and not history_df.empty:
-                file_name = f"{ticker}.parquet"
-                print(f"Dati validi trovati. Avvio upload su Google Drive come '{file_name}'...")
-                upload_or_update_parquet(gdrive_service, history_df, file_name, raw_history_folder_id)
+        # L'upload confronta ogni storico con la versione su Drive: si registra solo l'intervallo modificato
+        stages = make_refresh_stages(lambda ticker: fetch_history_for_ticker(ticker, EODHD_API_KEY, START_DATE),
+                                     GDRIVE_SA_KEY, raw_history_folder_id,
+                                     fetch_workers=FETCH_WORKERS, transform_workers=TRANSFORM_WORKERS, upload_workers=UPLOAD_WORKERS,
+                                     track_changes=True)
+        metrics = []
+        started = time.perf_counter()
+        failed = []
+        changes = []
+        for result in run_pipeline(TICKERS_TO_FIX, stages, metrics=metrics):
+            if result.error is not None or result.value is None:
+                print(f"!!! Fix fallito per {result.key} nello stadio '{result.stage}': {result.error or 'dati non disponibili o vuoti'}")
+                failed.append(result.key)
+                continue
+            print(f"Fix completato per {result.key}: {result.value['rows']} righe fino al {result.value['last_date']}.")
+            changed_range = result.value['changed_range']
+            if changed_range is None:
+                print(f"Nessuna variazione nello storico di {result.key}: ASI non invalidato.")
             else:
-                raise ValueError(f"Download fallito per {ticker}. Dati non disponibili o vuoti.")
+                print(f"Storico di {result.key} modificato tra {changed_range[0].date()} e {changed_range[1].date()}.")
+                changes.append((result.key, *changed_range))
+        print_metrics(metrics, time.perf_counter() - started)
+
+        if prod_folder_id:
+            append_dirty_ranges(gdrive_service, prod_folder_id, ASI_DIRTY_RANGES_FILE_NAME, changes)
+
+        if failed:
+            raise ValueError(f"Download fallito per {failed}. Dati non disponibili o vuoti.")
         
         print("\n>>> Processo di FIX MANUALE terminato con SUCCESSO.")
 
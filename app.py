@@ -9,9 +9,13 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Importiamo le nostre funzioni dai moduli
-from src.data_loader import load_production_asi
+from src.data_loader import load_production_asi, load_production_asi_variants
 from src.asi_indicator_calculator import calculate_asi_indicators
 from src.rule_engine import get_boost_ts1, get_boost_ts2
+from src.chart_utils import downsample_series
+
+# Punti massimi per traccia inviati al browser, indipendentemente dalla lunghezza dello storico
+MAX_CHART_POINTS = 1500
 
 # --- CONFIGURAZIONE PAGINA ---
 st.set_page_config(page_title="Kriterion Quant - Allocatore di Capitale", page_icon="🤖", layout="wide")
@@ -68,6 +72,17 @@ with data_container.container():
         st.stop()
     # --- FINE DELLA PATCH DI SICUREZZA ---
 
+# --- SELEZIONE VARIANTE ASI ---
+variants_df = load_production_asi_variants()
+if not variants_df.empty:
+    variant_names = ["Produzione"] + sorted(variants_df['variant'].unique().tolist())
+    selected_variant = st.sidebar.selectbox("Variante ASI", variant_names)
+    if selected_variant != "Produzione":
+        asi_df = (variants_df[variants_df['variant'] == selected_variant]
+                  .set_index('date')
+                  .sort_index()[['index_value', 'outperforming_count', 'basket_size']])
+        st.sidebar.info(f"Variante attiva: **{selected_variant}** ({len(asi_df)} giorni)")
+
 # 2. Esegui i calcoli
 indicators_df = calculate_asi_indicators(asi_df)
 logger.info(f"Indicatori calcolati: {list(indicators_df.columns)}, ultima riga: {indicators_df.iloc[-1]}")
@@ -96,27 +111,39 @@ with col2:
 st.markdown("---")
 st.subheader("Analisi Storica degli Indicatori")
 
-tab1, tab2, tab3 = st.tabs(["Storico ASI", "Analisi RSI", "Analisi Slope"])
+# Solo la vista selezionata viene costruita (st.tabs eseguirebbe sempre tutte e tre)
+history_view = st.radio("Vista", ["Storico ASI", "Analisi RSI", "Analisi Slope"], horizontal=True, label_visibility="collapsed")
+
+# Finestra visibile: restringendola, il downsampling mostra più dettaglio sul periodo scelto
+min_date, max_date = indicators_df.index.min().date(), indicators_df.index.max().date()
+visible_start, visible_end = st.slider("Periodo visualizzato", min_value=min_date, max_value=max_date,
+                                       value=(min_date, max_date), format="YYYY-MM-DD")
+visible_df = indicators_df.loc[str(visible_start):str(visible_end)]
+
+def history_trace(column: str, name: str, **kwargs) -> go.Scattergl:
+    """Traccia WebGL della colonna, ridotta con LTTB a MAX_CHART_POINTS sul periodo visibile."""
+    series = downsample_series(visible_df[column], MAX_CHART_POINTS)
+    return go.Scattergl(x=series.index, y=series.values, mode='lines', name=name, **kwargs)
 
-with tab1:
+if history_view == "Storico ASI":
     st.markdown("Andamento Storico dell'ASI e della sua Media Mobile a 30 giorni.")
     fig_hist = go.Figure()
-    fig_hist.add_trace(go.Scatter(x=indicators_df.index, y=indicators_df['index_value'], mode='lines', name='ASI'))
-    fig_hist.add_trace(go.Scatter(x=indicators_df.index, y=indicators_df['SMA_30'], mode='lines', name='SMA 30 Giorni', line={'dash': 'dash'}))
+    fig_hist.add_trace(history_trace('index_value', 'ASI'))
+    fig_hist.add_trace(history_trace('SMA_30', 'SMA 30 Giorni', line={'dash': 'dash'}))
     st.plotly_chart(fig_hist, use_container_width=True)
 
-with tab2:
+elif history_view == "Analisi RSI":
     st.markdown("RSI a 10 periodi calcolato sulla serie storica dell'ASI.")
     fig_rsi = go.Figure()
-    fig_rsi.add_trace(go.Scatter(x=indicators_df.index, y=indicators_df['RSI_10'], mode='lines', name='RSI(10) su ASI'))
+    fig_rsi.add_trace(history_trace('RSI_10', 'RSI(10) su ASI'))
     fig_rsi.add_hrect(y0=60, y1=100, line_width=0, fillcolor="red", opacity=0.1, layer="below")
     fig_rsi.add_hrect(y0=40, y1=60, line_width=0, fillcolor="yellow", opacity=0.1, layer="below")
     fig_rsi.add_hrect(y0=0, y1=40, line_width=0, fillcolor="green", opacity=0.1, layer="below")
     st.plotly_chart(fig_rsi, use_container_width=True)
 
-with tab3:
+else:
     st.markdown("Pendenza (Slope) a 30 periodi calcolata sulla serie storica dell'ASI.")
     fig_slope = go.Figure()
-    fig_slope.add_trace(go.Scatter(x=indicators_df.index, y=indicators_df['Slope_30'], mode='lines', name='Slope(30) su ASI'))
+    fig_slope.add_trace(history_trace('Slope_30', 'Slope(30) su ASI'))
     fig_slope.add_hline(y=0, line_dash="dash", line_color="grey")
     st.plotly_chart(fig_slope, use_container_width=True)
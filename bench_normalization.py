@@ -0,0 +1,83 @@
+# bench_normalization.py
+
+import io
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from typing import Callable, Tuple
+
+from src.normalization import normalize_eod_json, normalize_parquet_bytes, to_bar_frame, to_history_frame
+
+N_BARS = 3000
+REPEATS = 20
+
+def synthetic_eod_payload(n_bars: int, seed: int = 0) -> bytes:
+    """Risposta /eod simulata (JSON compatto come quello dell'API): barre giornaliere con qualche duplicato
+    e qualche valore mancante."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2018-01-01", periods=n_bars, freq="D").strftime("%Y-%m-%d").tolist()
+    closes = np.cumprod(1 + rng.normal(0, 0.03, n_bars)) * 100
+    records = [{'date': d, 'open': c, 'high': c, 'low': c, 'close': c, 'adjusted_close': c,
+                'volume': float(rng.integers(1_000, 1_000_000))} for d, c in zip(dates, closes)]
+    for i in rng.choice(n_bars, n_bars // 100, replace=False):
+        records[i]['adjusted_close'] = None
+    records.extend(records[-5:])
+    return json.dumps(records, separators=(',', ':')).encode()
+
+def legacy_fetch(payload: bytes) -> pd.DataFrame:
+    """Percorso precedente: DataFrame dal JSON e selezione delle colonne (come fetch_full_history_for_ticker)."""
+    df = pd.DataFrame(json.loads(payload))
+    close = df['adjusted_close'] if df['adjusted_close'].notna().any() else df['close']
+    return pd.DataFrame({'date': df['date'], 'close': close, 'volume': df['volume']})
+
+def legacy_clean(data: bytes) -> pd.DataFrame:
+    """Percorso precedente: pulizia del Parquet scaricato (come download_all_parquets_in_folder)."""
+    df = pd.read_parquet(io.BytesIO(data))
+    df.dropna(subset=['date', 'close', 'volume'], inplace=True)
+    df.drop_duplicates(subset=['date'], keep='last', inplace=True)
+    df['date'] = pd.to_datetime(df['date'])
+    df.set_index('date', inplace=True)
+    df = df[~df.index.duplicated(keep='last')]
+    df.sort_index(inplace=True)
+    return df
+
+def measure(func: Callable[[], object]) -> Tuple[float, float, float]:
+    """
+    Ritorna (tempo medio in ms, picco dell'heap Python in KB, memoria Arrow trattenuta dal risultato in KB)
+    su REPEATS esecuzioni. tracemalloc non vede il pool di Arrow, che viene quindi misurato a parte.
+    """
+    func()
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        func()
+    elapsed_ms = (time.perf_counter() - started) / REPEATS * 1000
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    arrow_retained = pa.total_allocated_bytes() - arrow_before
+    del result
+    return elapsed_ms, peak / 1024, arrow_retained / 1024
+
+if __name__ == "__main__":
+    n_bars = int(sys.argv[1]) if len(sys.argv) > 1 else N_BARS
+    payload = synthetic_eod_payload(n_bars)
+    parquet_buffer = io.BytesIO()
+    legacy_fetch(payload).to_parquet(parquet_buffer, index=False)
+    parquet_bytes = parquet_buffer.getvalue()
+
+    cases = [
+        ("fetch JSON  (pandas)", lambda: legacy_fetch(payload)),
+        ("fetch JSON  (arrow) ", lambda: to_bar_frame(normalize_eod_json(payload))),
+        ("pulizia Parquet (pandas)", lambda: legacy_clean(parquet_bytes)),
+        ("pulizia Parquet (arrow) ", lambda: to_history_frame(normalize_parquet_bytes(parquet_bytes))),
+    ]
+    print(f"Normalizzazione di {n_bars} barre per ticker ({REPEATS} ripetizioni)")
+    for name, func in cases:
+        elapsed_ms, peak_kb, arrow_kb = measure(func)
+        print(f"{name:<26} {elapsed_ms:8.2f} ms  picco heap {peak_kb:10.1f} KB  Arrow {arrow_kb:8.1f} KB")
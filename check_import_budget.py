@@ -0,0 +1,81 @@
+# check_import_budget.py
+#
+# Verifica tempo di import e moduli pesanti degli entry point: `python check_import_budget.py`
+# (eseguito anche dal workflow .github/workflows/import_budget.yml). Esce con codice 1 se un entry point
+# supera il budget o non si importa.
+
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple, Set, Tuple
+
+class EntryPointBudget(NamedTuple):
+    """
+    Budget di avvio di un entry point.
+    Campi:
+        name: Nome dell'entry point
+        modules: Moduli importati all'avvio (per app.py: le sue dipendenze, lo script non è importabile)
+        budget_ms: Tempo massimo di import cumulativo in millisecondi
+        deferred: Moduli pesanti che NON devono essere caricati all'import
+    """
+    name: str
+    modules: List[str]
+    budget_ms: int
+    deferred: List[str]
+
+ENTRY_POINTS = [
+    EntryPointBudget("app.py", ["streamlit", "plotly.graph_objects", "src.data_loader", "src.asi_indicator_calculator",
+                                "src.rule_engine", "src.chart_utils"], 3000, ["googleapiclient", "google.oauth2"]),
+    EntryPointBudget("run_full_refresh.py", ["run_full_refresh"], 1500, ["googleapiclient", "google.oauth2", "streamlit", "plotly"]),
+    EntryPointBudget("add_missing_ticker.py", ["add_missing_ticker"], 1500, ["googleapiclient", "google.oauth2", "streamlit", "plotly"]),
+    EntryPointBudget("run_asi_recompute.py", ["run_asi_recompute"], 1500, ["googleapiclient", "google.oauth2", "streamlit", "plotly"]),
+    EntryPointBudget("run_backtest.py", ["run_backtest"], 1500, ["googleapiclient", "google.oauth2", "streamlit", "plotly"]),
+    EntryPointBudget("run_asi_variants.py", ["run_asi_variants"], 1500, ["googleapiclient", "google.oauth2", "streamlit", "plotly"]),
+]
+
+def measure_imports(modules: List[str]) -> Tuple[float, Set[str]]:
+    """
+    Importa i moduli in un interprete pulito con `-X importtime`.
+    Ritorna (tempo cumulativo in ms dei moduli di primo livello, insieme dei moduli caricati).
+    """
+    code = "; ".join(f"import {module}" for module in modules)
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                               capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    total_us = 0
+    loaded = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line[len("import time:"):].split("|")
+        # L'indentazione indica l'annidamento: le righe senza rientro sono gli import di primo livello
+        if not package[1:].startswith(" "):
+            total_us += int(cumulative)
+        loaded.add(package.strip())
+    return total_us / 1000, loaded
+
+if __name__ == "__main__":
+    failures = []
+    for entry_point in ENTRY_POINTS:
+        try:
+            total_ms, loaded = measure_imports(entry_point.modules)
+        except subprocess.CalledProcessError as e:
+            # Un entry point che non si importa è un fallimento da riportare, non un motivo per fermare il controllo
+            error_lines = (e.stderr or "").strip().splitlines()
+            print(f"{entry_point.name:<24} IMPORT FALLITO")
+            print(f"  - {error_lines[-1] if error_lines else f'codice di uscita {e.returncode}'}")
+            failures.append(entry_point.name)
+            continue
+        loaded_heavy = sorted({module for module in loaded for deferred in entry_point.deferred
+                               if module == deferred or module.startswith(deferred + ".")})
+        status = "OK" if total_ms <= entry_point.budget_ms and not loaded_heavy else "FUORI BUDGET"
+        print(f"{entry_point.name:<24} {total_ms:8.1f} ms / {entry_point.budget_ms} ms  {status}")
+        if loaded_heavy:
+            print(f"  - moduli pesanti caricati all'import: {loaded_heavy}")
+        if status != "OK":
+            failures.append(entry_point.name)
+
+    if failures:
+        print(f"!!! Budget di import superato o import fallito per: {failures}")
+        sys.exit(1)
+    print("Tutti gli entry point rispettano il budget di import.")
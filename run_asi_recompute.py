@@ -0,0 +1,116 @@
+# run_asi_recompute.py
+
+import os
+import argparse
+import time
+import traceback
+import pandas as pd
+from src.gdrive_service import get_gdrive_service, find_id, download_parquet, upload_or_update_parquet, download_all_parquets_in_folder
+from src.data_processing import (BASKET_HISTORY_FILE_NAME, BASKET_HISTORY_COLUMNS, build_historical_frames,
+                                 extend_basket_history, baskets_from_history)
+from src.asi_recompute import (ASI_FILE_NAME, load_dirty_ranges, consume_dirty_ranges, refresh_affected_rebalances,
+                               affected_rebalance_dates, find_dirty_dates, recompute_dirty_asi)
+from src.streaming_aggregation import stream_raw_history, combine_basket_histories
+
+# --- CONFIGURAZIONE ---
+GDRIVE_SA_KEY = os.getenv("GDRIVE_SA_KEY")
+ROOT_FOLDER_NAME = "KriterionQuant_Data"
+RAW_HISTORY_FOLDER_NAME = "raw-history"
+PRODUCTION_FOLDER_NAME = "production"
+PERFORMANCE_WINDOW = 90
+
+def _load_asi(service, folder_id: str) -> pd.DataFrame:
+    file_id = find_id(service, name=ASI_FILE_NAME, parent_id=folder_id)
+    asi_df = download_parquet(service, file_id) if file_id else None
+    if asi_df is None or asi_df.empty:
+        raise FileNotFoundError(f"'{ASI_FILE_NAME}' non trovato o vuoto: eseguire prima un calcolo completo.")
+    asi_df['date'] = pd.to_datetime(asi_df['date'])
+    return asi_df.set_index('date').sort_index()
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Ricalcola l'ASI solo sulle date toccate dagli intervalli modificati.")
+    parser.add_argument("--memory-budget-mb", type=float, default=None,
+                        help="Legge lo storico un ticker alla volta tenendo in memoria al massimo questi MB di close.")
+    parser.add_argument("--n-jobs", type=int, default=1, help="Processi per il calcolo dell'ASI a shard sull'asse delle date.")
+    parser.add_argument("--shard-size", type=int, default=None,
+                        help="Righe (date) per shard; default: divisione uniforme tra i processi.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        print(">>> Inizio ricalcolo ASI sugli intervalli modificati...")
+        if not GDRIVE_SA_KEY:
+            raise ValueError("La variabile d'ambiente GDRIVE_SA_KEY non è impostata.")
+        started = time.perf_counter()
+
+        gdrive_service = get_gdrive_service(GDRIVE_SA_KEY)
+        root_folder_id = find_id(gdrive_service, name=ROOT_FOLDER_NAME, mime_type='application/vnd.google-apps.folder')
+        raw_history_folder_id = find_id(gdrive_service, name=RAW_HISTORY_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
+        prod_folder_id = find_id(gdrive_service, name=PRODUCTION_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
+        if not all([root_folder_id, raw_history_folder_id, prod_folder_id]):
+            raise FileNotFoundError("Cartelle di Google Drive mancanti.")
+
+        # Registri di tutti i writer dello storico (fix manuali, shard del refresh completo e incrementale)
+        dirty_ranges, dirty_range_files = load_dirty_ranges(gdrive_service, prod_folder_id)
+        if dirty_ranges is None:
+            print("Nessun intervallo modificato registrato. Niente da ricalcolare.")
+            raise SystemExit(0)
+        print(f"Intervalli modificati: {len(dirty_ranges)} su {dirty_ranges['ticker'].nunique()} ticker ({len(dirty_range_files)} registri)")
+
+        asi_df = _load_asi(gdrive_service, prod_folder_id)
+        performance_window = int(asi_df['performance_window'].dropna().iloc[-1]) if 'performance_window' in asi_df.columns else PERFORMANCE_WINDOW
+
+        # Panieri: ricalcolo dei soli ribilanciamenti con finestra di volume toccata dalle modifiche
+        history_id = find_id(gdrive_service, name=BASKET_HISTORY_FILE_NAME, parent_id=prod_folder_id)
+        old_history = download_parquet(gdrive_service, history_id) if history_id else None
+        if old_history is None or old_history.empty:
+            old_history = pd.DataFrame(columns=BASKET_HISTORY_COLUMNS)
+        else:
+            old_history['rebalance_date'] = pd.to_datetime(old_history['rebalance_date'])
+
+        if args.memory_budget_mb:
+            # Modalità a memoria limitata: restano in memoria solo i close dei ticker dei panieri
+            closes, streamed_history = stream_raw_history(gdrive_service, raw_history_folder_id, old_history,
+                                                          args.memory_budget_mb)
+            refreshed = affected_rebalance_dates(old_history, dirty_ranges) if not old_history.empty else []
+            basket_history, changed_rebalances = combine_basket_histories(old_history, streamed_history, refreshed)
+        else:
+            closes, long_df = build_historical_frames(download_all_parquets_in_folder(gdrive_service, raw_history_folder_id))
+            if old_history.empty:
+                basket_history = extend_basket_history(long_df)
+                changed_rebalances = sorted(basket_history['rebalance_date'].unique())
+            else:
+                basket_history, changed_rebalances = refresh_affected_rebalances(long_df, old_history, dirty_ranges)
+                basket_history = extend_basket_history(long_df, basket_history,
+                                                       top_n=int(old_history['top_n'].iloc[0]),
+                                                       lookback_days=int(old_history['lookback_days'].iloc[0]),
+                                                       rebalancing_freq=old_history['rebalancing_freq'].iloc[0])
+        print(f"Ribilanciamenti con paniere cambiato: {len(changed_rebalances)}")
+
+        end_date = closes.index.max()
+        old_baskets = baskets_from_history(old_history, end_date)
+        baskets = baskets_from_history(basket_history, end_date)
+        changed_basket_dates = {key for key, basket in baskets.items() if old_baskets.get(key) != basket}
+
+        dirty_dates = find_dirty_dates(asi_df.index, baskets, dirty_ranges, performance_window, changed_basket_dates)
+        updated_asi, stats = recompute_dirty_asi(asi_df, closes, baskets, dirty_dates, performance_window,
+                                                 n_jobs=args.n_jobs, shard_size=args.shard_size)
+        updated_asi.index.name = 'date'
+
+        upload_or_update_parquet(gdrive_service, updated_asi, ASI_FILE_NAME, prod_folder_id)
+        if changed_rebalances or len(basket_history) != len(old_history):
+            upload_or_update_parquet(gdrive_service, basket_history, BASKET_HISTORY_FILE_NAME, prod_folder_id)
+        # Registri consumati: tolte solo le righe lette, e solo dopo aver salvato l'ASI aggiornato
+        consume_dirty_ranges(gdrive_service, prod_folder_id, dirty_range_files, dirty_ranges)
+
+        print(f"Righe ASI invalidate e ricalcolate: {stats['invalidated']} in {stats['blocks']} blocchi di date consecutive")
+        print(f"Righe ASI riutilizzate: {stats['reused']} su {stats['total']}")
+        print(f"\n>>> Ricalcolo ASI terminato in {time.perf_counter() - started:.1f}s.")
+
+    except SystemExit:
+        raise
+    except Exception as e:
+        print(f"!!! RICALCOLO ASI FALLITO: {e}")
+        traceback.print_exc()
+        raise
@@ -0,0 +1,83 @@
+# run_asi_variants.py
+
+import os
+import argparse
+import itertools
+import time
+import traceback
+import pandas as pd
+from src.gdrive_service import get_gdrive_service, find_id, upload_or_update_parquet, download_all_parquets_in_folder
+from src.data_processing import (ASI_VARIANTS_FILE_NAME, BASKET_HISTORY_FILE_NAME, ASIVariant, build_historical_frames,
+                                 update_basket_history_on_drive, download_basket_history, baskets_from_history,
+                                 calculate_asi_variants)
+from src.streaming_aggregation import stream_raw_history, combine_basket_histories
+
+# --- CONFIGURAZIONE ---
+GDRIVE_SA_KEY = os.getenv("GDRIVE_SA_KEY")
+ROOT_FOLDER_NAME = "KriterionQuant_Data"
+RAW_HISTORY_FOLDER_NAME = "raw-history"
+PRODUCTION_FOLDER_NAME = "production"
+# Parametri dei panieri di produzione (devono coincidere con quelli dello storico panieri salvato)
+TOP_N = 50
+LOOKBACK_DAYS = 30
+REBALANCING_FREQ = '90D'
+
+# Varianti pubblicate per la dashboard: finestre di performance, top-30/top-50, media vs rendimento cumulato
+PERFORMANCE_WINDOWS = [30, 60, 90]
+BASKET_SIZES = [30, 50]
+ASI_VARIANTS = [ASIVariant(name=f"pw{window}_top{top_n}_{method}", performance_window=window, top_n=top_n, method=method)
+                for window, top_n, method in itertools.product(PERFORMANCE_WINDOWS, BASKET_SIZES, ('mean', 'cumulative'))]
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Calcola le varianti dell'ASI in un solo passaggio e le salva su Drive.")
+    parser.add_argument("--no-upload", action="store_true", help="Stampa il riepilogo senza salvare le varianti su Drive.")
+    parser.add_argument("--memory-budget-mb", type=float, default=None,
+                        help="Legge lo storico un ticker alla volta tenendo in memoria al massimo questi MB di close.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        print(">>> Inizio calcolo delle varianti ASI...")
+        if not GDRIVE_SA_KEY:
+            raise ValueError("La variabile d'ambiente GDRIVE_SA_KEY non è impostata.")
+        started = time.perf_counter()
+
+        gdrive_service = get_gdrive_service(GDRIVE_SA_KEY)
+        root_folder_id = find_id(gdrive_service, name=ROOT_FOLDER_NAME, mime_type='application/vnd.google-apps.folder')
+        raw_history_folder_id = find_id(gdrive_service, name=RAW_HISTORY_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
+        prod_folder_id = find_id(gdrive_service, name=PRODUCTION_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
+        if not all([root_folder_id, raw_history_folder_id, prod_folder_id]):
+            raise FileNotFoundError("Cartelle di Google Drive mancanti.")
+
+        if args.memory_budget_mb:
+            # Modalità a memoria limitata: restano in memoria solo i close dei ticker dei panieri
+            stored_history = download_basket_history(gdrive_service, prod_folder_id)
+            closes, streamed_history = stream_raw_history(gdrive_service, raw_history_folder_id, stored_history,
+                                                          args.memory_budget_mb, TOP_N, LOOKBACK_DAYS, REBALANCING_FREQ)
+            basket_history, new_rebalances = combine_basket_histories(stored_history, streamed_history)
+            if new_rebalances:
+                upload_or_update_parquet(gdrive_service, basket_history, BASKET_HISTORY_FILE_NAME, prod_folder_id)
+            baskets = baskets_from_history(basket_history, closes.index.max())
+        else:
+            data_dict = download_all_parquets_in_folder(gdrive_service, raw_history_folder_id)
+            closes, long_df = build_historical_frames(data_dict)
+            # Lo storico panieri salvato avanza dei soli ribilanciamenti diventati dovuti dall'ultima esecuzione
+            basket_history, baskets = update_basket_history_on_drive(gdrive_service, long_df, prod_folder_id,
+                                                                     TOP_N, LOOKBACK_DAYS, REBALANCING_FREQ)
+        print(f"Storico panieri: {basket_history['rebalance_date'].nunique()} ribilanciamenti, "
+              f"ultimo il {pd.Timestamp(basket_history['rebalance_date'].max()).date()}.")
+
+        variants_df = calculate_asi_variants(closes, baskets, ASI_VARIANTS)
+        latest = variants_df.sort_values('date').groupby('variant').tail(1)
+        with pd.option_context('display.width', 160):
+            print(latest[['variant', 'date', 'index_value', 'outperforming_count', 'basket_size']].to_string(index=False))
+
+        if not args.no_upload:
+            upload_or_update_parquet(gdrive_service, variants_df, ASI_VARIANTS_FILE_NAME, prod_folder_id)
+        print(f"\n>>> {len(ASI_VARIANTS)} varianti ASI calcolate in {time.perf_counter() - started:.1f}s.")
+
+    except Exception as e:
+        print(f"!!! CALCOLO VARIANTI ASI FALLITO: {e}")
+        traceback.print_exc()
+        raise
@@ -0,0 +1,87 @@
+# run_backtest.py
+
+import os
+import argparse
+import time
+import traceback
+import pandas as pd
+from src.gdrive_service import get_gdrive_service, find_id, download_parquet, upload_or_update_parquet, download_all_parquets_in_folder
+from src.data_processing import (BASKET_HISTORY_FILE_NAME, build_historical_frames, extend_basket_history, baskets_from_history,
+                                 download_basket_history)
+from src.streaming_aggregation import stream_raw_history, combine_basket_histories
+from src.asi_indicator_calculator import calculate_asi_indicators
+from src.asi_recompute import ASI_FILE_NAME
+from src.rule_engine import RuleSet, TS1_RULES, TS2_RULES
+from src.backtest import (BACKTEST_SUMMARY_FILE_NAME, BACKTEST_EQUITY_FILE_NAME, asset_returns, run_backtest,
+                          equity_long_format)
+
+# --- CONFIGURAZIONE ---
+GDRIVE_SA_KEY = os.getenv("GDRIVE_SA_KEY")
+ROOT_FOLDER_NAME = "KriterionQuant_Data"
+RAW_HISTORY_FOLDER_NAME = "raw-history"
+PRODUCTION_FOLDER_NAME = "production"
+# Riferimento: versamento costante Standard, indipendente dalle fasi
+DCA_RULES = RuleSet("DCA", high=frozenset(), low=frozenset())
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Backtest storico delle allocazioni TS1/TS2 su BTC e paniere di altcoin.")
+    parser.add_argument("--deploy-freq", default="7D", help="Frequenza dei versamenti (offset pandas, es. 7D, 30D).")
+    parser.add_argument("--n-jobs", type=int, default=1, help="Processi per la simulazione delle varianti.")
+    parser.add_argument("--no-upload", action="store_true", help="Stampa il riepilogo senza salvare i risultati su Drive.")
+    parser.add_argument("--memory-budget-mb", type=float, default=None,
+                        help="Legge lo storico un ticker alla volta tenendo in memoria al massimo questi MB di close.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        print(">>> Inizio backtest delle allocazioni...")
+        if not GDRIVE_SA_KEY:
+            raise ValueError("La variabile d'ambiente GDRIVE_SA_KEY non è impostata.")
+        started = time.perf_counter()
+
+        gdrive_service = get_gdrive_service(GDRIVE_SA_KEY)
+        root_folder_id = find_id(gdrive_service, name=ROOT_FOLDER_NAME, mime_type='application/vnd.google-apps.folder')
+        raw_history_folder_id = find_id(gdrive_service, name=RAW_HISTORY_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
+        prod_folder_id = find_id(gdrive_service, name=PRODUCTION_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
+        if not all([root_folder_id, raw_history_folder_id, prod_folder_id]):
+            raise FileNotFoundError("Cartelle di Google Drive mancanti.")
+
+        asi_id = find_id(gdrive_service, name=ASI_FILE_NAME, parent_id=prod_folder_id)
+        asi_df = download_parquet(gdrive_service, asi_id) if asi_id else None
+        if asi_df is None or asi_df.empty:
+            raise FileNotFoundError(f"'{ASI_FILE_NAME}' non trovato o vuoto: eseguire prima un calcolo completo.")
+        asi_df['date'] = pd.to_datetime(asi_df['date'])
+        indicators_df = calculate_asi_indicators(asi_df.set_index('date').sort_index()[['index_value']].dropna())
+
+        if args.memory_budget_mb:
+            # Modalità a memoria limitata: restano in memoria solo i close dei ticker dei panieri
+            stored_history = download_basket_history(gdrive_service, prod_folder_id)
+            closes, streamed_history = stream_raw_history(gdrive_service, raw_history_folder_id, stored_history,
+                                                          args.memory_budget_mb)
+            basket_history, _ = combine_basket_histories(stored_history, streamed_history)
+        else:
+            data_dict = download_all_parquets_in_folder(gdrive_service, raw_history_folder_id)
+            closes, long_df = build_historical_frames(data_dict)
+            history_id = find_id(gdrive_service, name=BASKET_HISTORY_FILE_NAME, parent_id=prod_folder_id)
+            basket_history = download_parquet(gdrive_service, history_id) if history_id else None
+            if basket_history is None or basket_history.empty:
+                basket_history = extend_basket_history(long_df)
+            else:
+                basket_history['rebalance_date'] = pd.to_datetime(basket_history['rebalance_date'])
+        baskets = baskets_from_history(basket_history, closes.index.max())
+
+        result = run_backtest(indicators_df, asset_returns(closes, baskets), [TS1_RULES, TS2_RULES, DCA_RULES],
+                              deploy_freq=args.deploy_freq, n_jobs=args.n_jobs)
+        with pd.option_context('display.width', 160, 'display.float_format', '{:,.2f}'.format):
+            print(result.summary.to_string(index=False))
+
+        if not args.no_upload:
+            upload_or_update_parquet(gdrive_service, result.summary, BACKTEST_SUMMARY_FILE_NAME, prod_folder_id)
+            upload_or_update_parquet(gdrive_service, equity_long_format(result), BACKTEST_EQUITY_FILE_NAME, prod_folder_id)
+        print(f"\n>>> Backtest terminato in {time.perf_counter() - started:.1f}s.")
+
+    except Exception as e:
+        print(f"!!! BACKTEST FALLITO: {e}")
+        traceback.print_exc()
+        raise
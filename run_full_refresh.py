@@ -1,12 +1,25 @@
 # run_full_refresh.py (VERSIONE FINALE E CORRETTA)
 
 import os
+import argparse
 import pandas as pd
 import requests
 import time
 import traceback
-from typing import List, Optional
-from src.gdrive_service import get_gdrive_service, find_id, upload_or_update_parquet
+from datetime import timedelta
+from typing import Callable, List, Optional, Set, Tuple
+from src.gdrive_service import get_gdrive_service, find_id, upload_or_update_parquet, download_parquet, download_bytes, list_files_in_folder
+from src.data_processing import rebalance_schedule
+from src.liquidity_screen import (LIQUIDITY_SUMMARY_FILE_NAME, LiquidityScreenError, update_liquidity_summary,
+                                  screen_liquid_candidates, log_skipped)
+from src.pipeline import run_pipeline, print_metrics
+from src.refresh_stages import make_refresh_stages
+from src.normalization import normalize_eod_json, to_bar_frame
+from src.refresh_manifest import (RefreshManifest, RefreshPlan, shard_tickers, manifest_file_name, save_refresh_plan,
+                                  load_refresh_plan, STATUS_COMPLETE, STATUS_NO_DATA, STATUS_FAILED)
+from src.asi_recompute import append_dirty_ranges, dirty_ranges_file_name
+from src.universe_manifest import (UniverseManifest, UniverseDiff, universe_manifest_file_name, last_complete_day,
+                                   clip_bars, resync_start, collect_bulk_bars, append_history)
 
 # --- CONFIGURAZIONE ---
 EODHD_API_KEY = os.getenv("EODHD_API_KEY")
@@ -14,7 +27,12 @@ GDRIVE_SA_KEY = os.getenv("GDRIVE_SA_KEY")
 CRYPTO_EXCHANGE_CODE = "CC"
 ROOT_FOLDER_NAME = "KriterionQuant_Data"
 RAW_HISTORY_FOLDER_NAME = "raw-history"
+PRODUCTION_FOLDER_NAME = "production"
 START_DATE = "2018-01-01"
+# Parametri dei panieri usati dallo screening di liquidità (devono coincidere con create_dynamic_baskets)
+BASKET_TOP_N = 50
+BASKET_LOOKBACK_DAYS = 30
+BASKET_REBALANCING_FREQ = "90D"
 
 def get_all_tickers(api_key: str, exchange_code: str) -> List[str]:
     print(f"Recupero lista ticker per exchange '{exchange_code}'...")
@@ -50,42 +68,167 @@ def get_all_tickers(api_key: str, exchange_code: str) -> List[str]:
         raise
 
 def fetch_full_history_for_ticker(ticker: str, api_key: str, start_date: str) -> Optional[pd.DataFrame]:
-    url = f"https://eodhd.com/api/eod/{ticker}?api_token={api_key}&fmt=json&period=d&from={start_date}"
+    # Solo giorni conclusi: la barra di oggi è parziale e, una volta salvata, non verrebbe più sostituita
+    end_date = last_complete_day()
+    url = f"https://eodhd.com/api/eod/{ticker}?api_token={api_key}&fmt=json&period=d&from={start_date}&to={end_date.strftime('%Y-%m-%d')}"
     try:
         r = requests.get(url, timeout=60)
         r.raise_for_status()
-        data = r.json()
-        if not data: return None
-        
-        df = pd.DataFrame(data)
-
-        final_data = {}
-
-        if 'date' in df.columns:
-            final_data['date'] = df['date']
-        else: return None
-
-        if 'adjusted_close' in df.columns and df['adjusted_close'].notna().any():
-            final_data['close'] = df['adjusted_close']
-        elif 'close' in df.columns:
-            final_data['close'] = df['close']
-        else:
-            print(f"  - Dati per {ticker} non contengono una colonna 'close' valida. Salto.")
+        # Il JSON viene portato direttamente in colonne Arrow tipizzate (date32/float32/float64),
+        # già ordinate, deduplicate e senza NaN: niente DataFrame intermedio sui dati grezzi
+        try:
+            table = normalize_eod_json(r.content)
+        except ValueError as e:
+            print(f"  - Dati per {ticker} non validi ({e}). Salto.")
             return None
+        if table.num_rows == 0: return None
 
-        if 'volume' in df.columns:
-            final_data['volume'] = df['volume']
-        else:
-            print(f"  - Dati per {ticker} non contengono la colonna 'volume'. Salto.")
-            return None
-        
-        return pd.DataFrame(final_data)
+        history_df = clip_bars(to_bar_frame(table), end_date)
+        return history_df if not history_df.empty else None
 
     except requests.exceptions.RequestException as e:
         print(f"  - ERRORE API durante il download di {ticker}: {e}")
         return None
 
+def prescreen_universe(service, root_folder_id: str, tickers: List[str], top_n: int, lookback_days: int,
+                       rebalancing_freq: str, margin: int) -> List[str]:
+    """
+    Fase 1 del refresh: usa il riepilogo dei volumi per ribilanciamento (aggiornato con snapshot bulk
+    solo per le date mancanti) per tenere i soli ticker che possono entrare in un paniere top-N.
+    """
+    summary_id = find_id(service, name=LIQUIDITY_SUMMARY_FILE_NAME, parent_id=root_folder_id)
+    stored_summary = download_parquet(service, summary_id) if summary_id else None
+
+    rebalance_dates = rebalance_schedule(START_DATE, pd.Timestamp.today().normalize(), rebalancing_freq)
+    volume_summary = update_liquidity_summary(EODHD_API_KEY, CRYPTO_EXCHANGE_CODE, rebalance_dates, lookback_days, stored_summary)
+    if stored_summary is None or len(volume_summary) != len(stored_summary):
+        upload_or_update_parquet(service, volume_summary, LIQUIDITY_SUMMARY_FILE_NAME, root_folder_id)
+
+    candidates, skipped = screen_liquid_candidates(tickers, volume_summary, rebalance_dates, top_n, lookback_days, margin)
+    log_skipped(skipped)
+    print(f"Screening liquidità: {len(candidates)} candidati su {len(tickers)} ticker (BTC incluso).")
+    return candidates
+
+def build_refresh_plan(service, root_folder_id: str, args: argparse.Namespace) -> RefreshPlan:
+    """
+    Fase 1 del refresh, eseguita una sola volta per run (--plan-only, prima della matrice di shard):
+    lista dei ticker e screening di liquidità. Il piano viene salvato su Drive e tutti gli shard
+    dividono la stessa lista; se il piano di questo run esiste già (resume) viene riusato.
+    """
+    plan = load_refresh_plan(service, root_folder_id, args.run_id)
+    if plan is not None:
+        print(f"Piano del run '{args.run_id}' già presente: {len(plan.candidates)} candidati su {len(plan.live_tickers)} ticker.")
+        return plan
+
+    live_tickers = get_all_tickers(EODHD_API_KEY, CRYPTO_EXCHANGE_CODE)
+    candidates = live_tickers
+    if args.prescreen:
+        try:
+            candidates = prescreen_universe(service, root_folder_id, live_tickers, args.top_n,
+                                            args.lookback_days, args.rebalancing_freq, args.screen_margin)
+        except LiquidityScreenError as e:
+            print(f"!!! Screening di liquidità non affidabile ({e}). Scarico l'intero universo.")
+    plan = RefreshPlan(live_tickers, candidates)
+    save_refresh_plan(service, root_folder_id, args.run_id, plan)
+    print(f"Piano del run '{args.run_id}' salvato: {len(plan.candidates)} candidati su {len(plan.live_tickers)} ticker.")
+    return plan
+
+def plan_sync(service, root_folder_id: str, universe: UniverseManifest, diff: UniverseDiff, owned: Set[str],
+              candidates: Set[str], drive_files: dict, args: argparse.Namespace) -> Tuple[List[str], Callable]:
+    """
+    Piano del refresh incrementale per i ticker di questo shard. Le richieste crescono con i cambiamenti
+    dell'universo, non con la sua dimensione:
+    - nuovi (e ticker senza storico che hanno ripreso a scambiare): storico completo, filtrato dallo screening
+    - esistenti: solo le barre dall'ultima data salvata (inclusa, per sostituire un'eventuale barra parziale)
+      a ieri, dagli snapshot bulk (una chiamata per giorno); i ticker rimasti indietro oltre la finestra bulk
+      fanno una richiesta a partire dalla loro ultima data
+    - delistati: nessuna richiesta
+    Ritorna (ticker da processare, funzione di fetch per lo stadio fetch della pipeline).
+    """
+    existing = [ticker for ticker in diff.existing if ticker in owned]
+    dormant = [ticker for ticker in diff.dormant if ticker in owned]
+    # Solo giorni completi: la barra di oggi è ancora parziale
+    yesterday = last_complete_day()
+    starts = {ticker: resync_start(universe.entries[ticker]['last_date'], yesterday) for ticker in existing}
+
+    # La finestra bulk parte dal ticker più indietro tra quelli che rientrano in --max-bulk-days:
+    # partire dal più aggiornato lascerebbe fuori tutti gli altri
+    window_floor = yesterday - timedelta(days=args.max_bulk_days - 1)
+    in_window = [start for start in starts.values() if start >= window_floor]
+    bulk_dates = pd.date_range(min(in_window), yesterday, freq='D') if in_window else pd.DatetimeIndex([])
+    try:
+        bulk_bars = collect_bulk_bars(EODHD_API_KEY, CRYPTO_EXCHANGE_CODE, bulk_dates, existing + dormant)
+    except LiquidityScreenError as e:
+        print(f"!!! Snapshot bulk non disponibili ({e}). Aggiornamento incrementale ticker per ticker.")
+        bulk_dates, bulk_bars = pd.DatetimeIndex([]), {}
+
+    # Un ticker è coperto dagli snapshot solo se la finestra parte entro il suo primo giorno da riscaricare
+    covered = {ticker for ticker in existing if len(bulk_dates) and starts[ticker] >= bulk_dates[0]}
+    incremental = [ticker for ticker in existing if ticker in covered and ticker in bulk_bars]
+    laggards = [ticker for ticker in existing if ticker not in covered]
+    full = [ticker for ticker in diff.new if ticker in owned] + [ticker for ticker in dormant if ticker in bulk_bars]
+    full = [ticker for ticker in full if ticker in candidates]
+
+    print(f"Sync: {len(full)} storici completi, {len(incremental)} aggiornamenti da {len(bulk_dates)} snapshot bulk, "
+          f"{len(laggards)} richieste dall'ultima data, {len(existing) - len(incremental) - len(laggards)} senza barre nella finestra bulk, "
+          f"{len([ticker for ticker in diff.delisted if ticker in owned])} delistati congelati.")
+
+    full_set = set(full)
+
+    def sync_fetch(ticker: str) -> Optional[pd.DataFrame]:
+        if ticker in full_set:
+            return fetch_full_history_for_ticker(ticker, EODHD_API_KEY, START_DATE)
+        delta_df = bulk_bars.get(ticker) if ticker in covered else \
+            fetch_full_history_for_ticker(ticker, EODHD_API_KEY, starts[ticker].strftime('%Y-%m-%d'))
+        if delta_df is None or delta_df.empty:
+            return None
+        drive_file = drive_files.get(f"{ticker}.parquet")
+        stored = download_bytes(get_gdrive_service(GDRIVE_SA_KEY), drive_file['id']) if drive_file else None
+        if stored is None:
+            print(f"  - Storico salvato di {ticker} non trovato su Drive: scarico lo storico completo.")
+            return fetch_full_history_for_ticker(ticker, EODHD_API_KEY, START_DATE)
+        return append_history(stored, delta_df, end_date=yesterday)
+
+    return sorted(full + incremental + laggards), sync_fetch
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Refresh completo dei dati storici (checkpointed e shardabile).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Salta i ticker già completati da questo run (--run-id) e non modificati su Drive.")
+    parser.add_argument("--run-id", default=os.getenv("REFRESH_RUN_ID") or pd.Timestamp.now(tz='UTC').strftime('%Y%m%dT%H%M%SZ'),
+                        help="Identificativo del refresh; per riprendere un run interrotto passare lo stesso valore con --resume.")
+    parser.add_argument("--shard-index", type=int, default=int(os.getenv("SHARD_INDEX", "0")),
+                        help="Indice (0-based) della fetta di ticker processata da questo job.")
+    parser.add_argument("--num-shards", type=int, default=int(os.getenv("NUM_SHARDS", "1")),
+                        help="Numero totale di fette disgiunte in cui dividere l'universo.")
+    parser.add_argument("--checkpoint-every", type=int, default=25,
+                        help="Numero di ticker processati tra due salvataggi del manifest.")
+    parser.add_argument("--plan-only", action="store_true",
+                        help="Calcola e salva solo il piano del run (lista ticker e screening), da eseguire una volta prima degli shard.")
+    parser.add_argument("--no-prescreen", dest="prescreen", action="store_false",
+                        help="Disattiva lo screening di liquidità e scarica l'intero universo.")
+    parser.add_argument("--top-n", type=int, default=BASKET_TOP_N)
+    parser.add_argument("--lookback-days", type=int, default=BASKET_LOOKBACK_DAYS)
+    parser.add_argument("--rebalancing-freq", default=BASKET_REBALANCING_FREQ)
+    parser.add_argument("--screen-margin", type=int, default=10,
+                        help="Posizioni extra oltre top-N considerate candidate per sicurezza.")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="Thread di download dall'API EODHD.")
+    parser.add_argument("--transform-workers", type=int, default=2, help="Thread di serializzazione Parquet.")
+    parser.add_argument("--upload-workers", type=int, default=4, help="Thread di upload su Google Drive.")
+    parser.add_argument("--queue-size", type=int, default=16,
+                        help="Capienza delle code tra gli stadi (backpressure).")
+    parser.add_argument("--manifest-dir", default=os.getenv("MANIFEST_DIR"),
+                        help="Cartella locale in cui salvare anche una copia del manifest.")
+    parser.add_argument("--sync", action="store_true",
+                        help="Refresh incrementale guidato dal manifest dell'universo: storico completo solo per i "
+                             "ticker nuovi, delta per quelli esistenti, nessuna richiesta per i delistati.")
+    parser.add_argument("--max-bulk-days", type=int, default=7,
+                        help="Giorni massimi recuperati con snapshot bulk in modalità --sync; "
+                             "i ticker più indietro vengono aggiornati con una richiesta ciascuno.")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
         if not all([EODHD_API_KEY, GDRIVE_SA_KEY]):
             raise ValueError("Errore: una o più variabili d'ambiente necessarie non sono state impostate.")
@@ -95,26 +238,105 @@ if __name__ == "__main__":
         root_folder_id = find_id(gdrive_service, name=ROOT_FOLDER_NAME, mime_type='application/vnd.google-apps.folder')
         raw_history_folder_id = find_id(gdrive_service, name=RAW_HISTORY_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
 
-        all_tickers = get_all_tickers(EODHD_API_KEY, CRYPTO_EXCHANGE_CODE)
-        
-        print(f"\nInizio download e salvataggio di {len(all_tickers)} file storici (dal {START_DATE})...")
-        for i, ticker in enumerate(all_tickers):
-            try:
-                print(f"Processo {i+1}/{len(all_tickers)}: {ticker}")
-                history_df = fetch_full_history_for_ticker(ticker, EODHD_API_KEY, START_DATE)
-                
-                if history_df is not None and not history_df.empty:
-                    file_name = f"{ticker}.parquet"
-                    upload_or_update_parquet(gdrive_service, history_df, file_name, raw_history_folder_id)
-                else:
-                    print(f"  - Dati non disponibili o vuoti per {ticker}. Salto.")
-            except Exception as e_inner:
-                print(f"!!! FALLIMENTO per {ticker}: {e_inner}. Continuo col prossimo.")
-                continue
-            time.sleep(0.2) 
+        # Lista ticker e screening: calcolati una sola volta per run e condivisi da tutti gli shard
+        if args.plan_only or args.num_shards == 1:
+            plan = build_refresh_plan(gdrive_service, root_folder_id, args)
+            if args.plan_only:
+                raise SystemExit(0)
+        else:
+            plan = load_refresh_plan(gdrive_service, root_folder_id, args.run_id)
+            if plan is None:
+                raise FileNotFoundError(f"Piano del run '{args.run_id}' non trovato: eseguire prima 'run_full_refresh.py --plan-only'.")
+        live_tickers = plan.live_tickers
+
+        # Differenza con il manifest dell'universo: ogni shard aggiorna la propria fetta (quotati + delistati)
+        universe = UniverseManifest(gdrive_service, root_folder_id, universe_manifest_file_name(args.shard_index, args.num_shards))
+        universe.load()
+        diff = universe.diff(live_tickers)
+        print(f"Universo: {len(diff.new)} nuovi, {len(diff.existing)} con storico, {len(diff.dormant)} senza storico, "
+              f"{len(diff.delisted)} delistati dall'ultimo refresh.")
+        owned = set(shard_tickers(sorted(set(live_tickers) | set(diff.delisted)), args.shard_index, args.num_shards))
+        universe.mark_seen([ticker for ticker in live_tickers if ticker in owned], pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%d'))
+        universe.mark_delisted([ticker for ticker in diff.delisted if ticker in owned])
+
+        # Intervalli riscritti o aggiunti: il job di ricalcolo invalida solo le date dell'ASI che ne dipendono.
+        # Vengono scritti a ogni checkpoint insieme al manifest dell'universo, prima che il manifest del run
+        # segni come completati i relativi ticker
+        prod_folder_id = find_id(gdrive_service, name=PRODUCTION_FOLDER_NAME, parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder')
+        pending_changes = []
+        changed_count = 0
+
+        def checkpoint() -> None:
+            if prod_folder_id and pending_changes:
+                append_dirty_ranges(gdrive_service, prod_folder_id,
+                                    dirty_ranges_file_name(f"refresh_{args.shard_index + 1}of{args.num_shards}"), pending_changes)
+            pending_changes.clear()
+            # Tutte le voci della partizione di questo shard, inclusi i delistati congelati nei run precedenti
+            universe.save(shard_tickers(universe.entries, args.shard_index, args.num_shards))
 
+        # Il sync non usa il resume: il suo manifest resta in memoria (solo per il riepilogo e i checkpoint)
+        # e non sovrascrive quello di un refresh completo da riprendere
+        if args.sync:
+            manifest = RefreshManifest(None, None, manifest_file_name(args.shard_index, args.num_shards), args.run_id,
+                                       checkpoint_every=args.checkpoint_every, on_checkpoint=checkpoint)
+        else:
+            manifest = RefreshManifest(gdrive_service, root_folder_id, manifest_file_name(args.shard_index, args.num_shards),
+                                       args.run_id, local_dir=args.manifest_dir, checkpoint_every=args.checkpoint_every,
+                                       on_checkpoint=checkpoint)
+        print(f"Run del refresh: '{args.run_id}'.")
+        drive_files = list_files_in_folder(gdrive_service, raw_history_folder_id, name_contains='.parquet')
+
+        if args.sync:
+            todo, fetch_func = plan_sync(gdrive_service, root_folder_id, universe, diff, owned, set(plan.candidates), drive_files, args)
+        else:
+            # Stessa partizione del manifest dell'universo: ogni ticker scaricato è già stato segnato come visto
+            # da questo shard, quindi la voce registrata non perde first_seen/last_seen nell'unione dei file
+            shard = shard_tickers(plan.candidates, args.shard_index, args.num_shards)
+            print(f"Shard {args.shard_index + 1}/{args.num_shards}: {len(shard)} ticker su {len(plan.candidates)}.")
+
+            if args.resume:
+                manifest.load()
+                todo = [ticker for ticker in shard if not manifest.is_done(ticker, drive_files)]
+                print(f"Resume: {len(shard) - len(todo)} ticker già completati, {len(todo)} da processare.")
+            else:
+                todo = shard
+            fetch_func = lambda ticker: fetch_full_history_for_ticker(ticker, EODHD_API_KEY, START_DATE)
+
+        print(f"\nInizio download e salvataggio di {len(todo)} file storici (dal {START_DATE})...")
+        stages = make_refresh_stages(fetch_func,
+                                     GDRIVE_SA_KEY, raw_history_folder_id, drive_files,
+                                     fetch_workers=args.fetch_workers, transform_workers=args.transform_workers,
+                                     upload_workers=args.upload_workers, track_changes=True)
+        metrics = []
+        started = time.perf_counter()
+        for i, result in enumerate(run_pipeline(todo, stages, queue_size=args.queue_size, metrics=metrics)):
+            ticker = result.key
+            print(f"Completato {i+1}/{len(todo)}: {ticker} (stadio '{result.stage}')")
+            if result.error is not None:
+                print(f"!!! FALLIMENTO per {ticker} nello stadio '{result.stage}': {result.error}. Continuo col prossimo.")
+                manifest.record(ticker, STATUS_FAILED)
+            elif result.value is None:
+                manifest.record(ticker, STATUS_NO_DATA)
+            else:
+                # Prima l'intervallo modificato: la registrazione nel manifest può far scattare il checkpoint
+                if result.value['changed_range'] is not None:
+                    pending_changes.append((ticker, *result.value['changed_range']))
+                    changed_count += 1
+                universe.record(ticker, result.value['rows'], result.value['last_date'])
+                manifest.record(ticker, STATUS_COMPLETE, rows=result.value['rows'],
+                                last_date=result.value['last_date'], checksum=result.value['md5Checksum'])
+        print_metrics(metrics, time.perf_counter() - started)
+
+        # Ultimo checkpoint fuori dal manifest: un errore qui deve interrompere il job, non solo essere stampato
+        checkpoint()
+        manifest.save()
+        print(f"Storici modificati: {changed_count} su {len(todo)} ticker processati.")
+        print(f"Riepilogo manifest: {manifest.summary()}")
+        print(f"Riepilogo universo: {universe.summary()}")
         print("\n>>> Processo di REFRESH COMPLETO terminato.")
     
+    except SystemExit:
+        raise
     except Exception as e_main:
         print(f"!!! ERRORE CRITICO NEL WORKFLOW: {e_main}")
         traceback.print_exc()
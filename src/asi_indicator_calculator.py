@@ -2,6 +2,12 @@
 
 import pandas as pd
 import numpy as np
+
+# Etichette delle fasi, nell'ordine delle categorie prodotte da pd.cut (usate anche dal rule engine)
+ASI_REGIME_LABELS = ["Basso (0-20)", "Neutro (20-60)", "Alto (60-100)"]
+RSI_PHASE_LABELS = ["Debole (<40)", "Neutro (40-60)", "Forte (>60)"]
+SLOPE_PHASE_LABELS = ["ForteDisc(<-0.5)", "Lat/Mod(-0.5/0.5)", "ForteSal(>0.5)"]
+
 # Potremmo usare una libreria come pandas_ta, ma per mantenere le dipendenze al minimo
 # e avere pieno controllo, ecco una funzione RSI standard.
 def _calculate_rsi(series, period=10):
@@ -46,17 +52,14 @@ def calculate_asi_indicators(asi_df: pd.DataFrame) -> pd.DataFrame:
     
     # Fase ASI basata su SMA_30
     sma_bins = [-np.inf, 20, 60, np.inf]
-    sma_labels = ["Basso (0-20)", "Neutro (20-60)", "Alto (60-100)"]
-    df['asi_regime'] = pd.cut(df['SMA_30'], bins=sma_bins, labels=sma_labels, right=True)
+    df['asi_regime'] = pd.cut(df['SMA_30'], bins=sma_bins, labels=ASI_REGIME_LABELS, right=True)
 
     # Fase RSI
     rsi_bins = [-np.inf, 39.99, 60, np.inf] # Usiamo 39.99 per includere 40 in 'Neutro'
-    rsi_labels = ["Debole (<40)", "Neutro (40-60)", "Forte (>60)"]
-    df['rsi_phase'] = pd.cut(df['RSI_10'], bins=rsi_bins, labels=rsi_labels, right=True)
+    df['rsi_phase'] = pd.cut(df['RSI_10'], bins=rsi_bins, labels=RSI_PHASE_LABELS, right=True)
 
     # Fase Slope
     slope_bins = [-np.inf, -0.5, 0.5, np.inf]
-    slope_labels = ["ForteDisc(<-0.5)", "Lat/Mod(-0.5/0.5)", "ForteSal(>0.5)"]
-    df['slope_phase'] = pd.cut(df['Slope_30'], bins=slope_bins, labels=slope_labels, right=False) # 'right=False' per allinearsi a 'Lat/Mod(-0.5/0.5)'
+    df['slope_phase'] = pd.cut(df['Slope_30'], bins=slope_bins, labels=SLOPE_PHASE_LABELS, right=False) # 'right=False' per allinearsi a 'Lat/Mod(-0.5/0.5)'
 
     return df
@@ -0,0 +1,217 @@
+# src/asi_recompute.py
+
+import logging
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.data_processing import BTC_TICKER, _ensure_datetime_index, _select_top_tickers, calculate_full_asi
+from src.gdrive_service import find_id, download_parquet, list_files_in_folder, upload_or_update_parquet
+
+logger = logging.getLogger(__name__)
+
+ASI_FILE_NAME = "altcoin_season_index.parquet"
+ASI_DIRTY_RANGES_PREFIX = "asi_dirty_ranges"
+ASI_DIRTY_RANGES_FILE_NAME = f"{ASI_DIRTY_RANGES_PREFIX}.parquet"
+DIRTY_RANGES_COLUMNS = ['ticker', 'start', 'end', 'recorded_at']
+
+def dirty_ranges_file_name(writer: Optional[str] = None) -> str:
+    """Registro condiviso, o uno per writer concorrente (es. shard del refresh): job paralleli non si sovrascrivono."""
+    return ASI_DIRTY_RANGES_FILE_NAME if writer is None else f"{ASI_DIRTY_RANGES_PREFIX}_{writer}.parquet"
+
+def detect_changed_range(old_df: Optional[pd.DataFrame], new_df: pd.DataFrame) -> Optional[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    Confronta due versioni dello storico di un ticker (colonne date, close, volume) e restituisce
+    l'intervallo [prima, ultima] data in cui differiscono (barre aggiunte, rimosse o riviste).
+    None se le due versioni coincidono.
+    """
+    def _by_date(df):
+        df = df[['date', 'close', 'volume']].dropna(subset=['date']).copy()
+        df['date'] = pd.to_datetime(df['date'])
+        # I close sono salvati in float32: il confronto avviene alla stessa precisione,
+        # così le versioni scritte prima del passaggio a float32 non risultano tutte modificate
+        df['close'] = df['close'].astype('float32')
+        return df.drop_duplicates(subset=['date'], keep='last').set_index('date').sort_index()
+
+    new = _by_date(new_df)
+    if old_df is None or old_df.empty:
+        return (new.index.min(), new.index.max()) if not new.empty else None
+    old = _by_date(old_df)
+
+    joined = old.join(new, how='outer', lsuffix='_old', rsuffix='_new')
+    changed = pd.Series(False, index=joined.index)
+    for column in ('close', 'volume'):
+        before, after = joined[f'{column}_old'], joined[f'{column}_new']
+        changed |= ~((before == after) | (before.isna() & after.isna()))
+    if not changed.any():
+        return None
+    changed_dates = joined.index[changed.to_numpy()]
+    return changed_dates.min(), changed_dates.max()
+
+def add_dirty_range(dirty_ranges: Optional[pd.DataFrame], ticker: str, start, end) -> pd.DataFrame:
+    """Aggiunge un intervallo modificato al registro consumato dal job di ricalcolo."""
+    row = pd.DataFrame([{
+        'ticker': ticker,
+        'start': pd.Timestamp(start),
+        'end': pd.Timestamp(end),
+        'recorded_at': pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }], columns=DIRTY_RANGES_COLUMNS)
+    if dirty_ranges is None or dirty_ranges.empty:
+        return row
+    return pd.concat([dirty_ranges, row], ignore_index=True)
+
+def append_dirty_ranges(service, folder_id: str, file_name: str, changes: List[Tuple[str, pd.Timestamp, pd.Timestamp]]) -> None:
+    """Aggiunge gli intervalli (ticker, inizio, fine) al registro `file_name` su Drive."""
+    if not changes:
+        return
+    file_id = find_id(service, name=file_name, parent_id=folder_id)
+    dirty_ranges = download_parquet(service, file_id) if file_id else None
+    for ticker, start, end in changes:
+        dirty_ranges = add_dirty_range(dirty_ranges, ticker, start, end)
+    upload_or_update_parquet(service, dirty_ranges, file_name, folder_id)
+    print(f"Registrati {len(changes)} intervalli modificati in '{file_name}'.")
+
+def load_dirty_ranges(service, folder_id: str) -> Tuple[Optional[pd.DataFrame], List[str]]:
+    """Unisce i registri di tutti i writer. Ritorna (intervalli o None, nomi dei file letti)."""
+    files = list_files_in_folder(service, folder_id, name_contains=ASI_DIRTY_RANGES_PREFIX)
+    names = sorted(name for name in files if name.endswith('.parquet'))
+    frames = [download_parquet(service, files[name]['id']) for name in names]
+    frames = [df for df in frames if df is not None and not df.empty]
+    if not frames:
+        return None, names
+    dirty_ranges = pd.concat(frames, ignore_index=True)
+    dirty_ranges['start'] = pd.to_datetime(dirty_ranges['start'])
+    dirty_ranges['end'] = pd.to_datetime(dirty_ranges['end'])
+    return dirty_ranges, names
+
+def _range_keys(dirty_ranges: pd.DataFrame) -> List[tuple]:
+    return list(zip(dirty_ranges['ticker'], pd.to_datetime(dirty_ranges['start']), pd.to_datetime(dirty_ranges['end']),
+                    dirty_ranges['recorded_at']))
+
+def consume_dirty_ranges(service, folder_id: str, file_names: List[str], consumed: pd.DataFrame) -> None:
+    """
+    Rimuove dai registri le sole righe consumate dal ricalcolo. I registri vengono riletti: gli intervalli
+    aggiunti da un writer dopo load_dirty_ranges restano per il ricalcolo successivo.
+    """
+    consumed_keys = set(_range_keys(consumed))
+    for file_name in file_names:
+        file_id = find_id(service, name=file_name, parent_id=folder_id)
+        current = download_parquet(service, file_id) if file_id else None
+        if current is None or current.empty:
+            continue
+        keep = [key not in consumed_keys for key in _range_keys(current)]
+        if all(keep):
+            continue
+        upload_or_update_parquet(service, current[keep].reset_index(drop=True), file_name, folder_id)
+
+def affected_rebalance_dates(basket_history: pd.DataFrame, dirty_ranges: pd.DataFrame) -> List[pd.Timestamp]:
+    """Date di ribilanciamento la cui finestra di volume si sovrappone a un intervallo modificato."""
+    affected = []
+    lookback_days = int(basket_history['lookback_days'].iloc[0])
+    for rebalance_date in sorted(pd.to_datetime(basket_history['rebalance_date'].unique())):
+        lookback_end = rebalance_date - timedelta(days=1)
+        lookback_start = lookback_end - timedelta(days=lookback_days)
+        if ((dirty_ranges['start'] <= lookback_end) & (dirty_ranges['end'] >= lookback_start)).any():
+            affected.append(pd.Timestamp(rebalance_date))
+    return affected
+
+def refresh_affected_rebalances(df: pd.DataFrame, basket_history: pd.DataFrame, dirty_ranges: pd.DataFrame) -> Tuple[pd.DataFrame, List[pd.Timestamp]]:
+    """
+    Ricalcola i soli ribilanciamenti la cui finestra di volume si sovrappone a un intervallo modificato.
+    Ritorna (storico panieri aggiornato, date di ribilanciamento il cui paniere è cambiato).
+    """
+    if basket_history is None or basket_history.empty:
+        return basket_history, []
+    df = _ensure_datetime_index(df)
+    top_n = int(basket_history['top_n'].iloc[0])
+    lookback_days = int(basket_history['lookback_days'].iloc[0])
+    affected = set(affected_rebalance_dates(basket_history, dirty_ranges))
+
+    changed_rebalances = []
+    updated = []
+    for rebalance_date, group in basket_history.sort_values(['rebalance_date', 'rank']).groupby('rebalance_date', sort=True):
+        rebalance_date = pd.Timestamp(rebalance_date)
+        if rebalance_date in affected:
+            top_tickers = _select_top_tickers(df, rebalance_date, top_n, lookback_days)
+            if top_tickers is not None and top_tickers != group['ticker'].tolist():
+                changed_rebalances.append(rebalance_date)
+                group = pd.DataFrame({
+                    'rebalance_date': rebalance_date, 'rank': range(len(top_tickers)), 'ticker': top_tickers,
+                    'top_n': top_n, 'lookback_days': lookback_days,
+                    'rebalancing_freq': group['rebalancing_freq'].iloc[0],
+                })
+        updated.append(group)
+    return pd.concat(updated, ignore_index=True), changed_rebalances
+
+def find_dirty_dates(asi_index: pd.DatetimeIndex, baskets: Dict[str, list], dirty_ranges: pd.DataFrame,
+                     performance_window: int, changed_basket_dates: Optional[Set[str]] = None) -> pd.DatetimeIndex:
+    """
+    Date dell'ASI da ricalcolare. Il valore di una data d dipende dai close di BTC e dei ticker del suo
+    paniere nella finestra [d - performance_window, d]: la data è sporca se un ticker da cui dipende è
+    cambiato in un intervallo che si sovrappone a quella finestra, o se il suo paniere è cambiato.
+    """
+    keys = asi_index.strftime('%Y-%m-%d')
+    window_start = asi_index - pd.Timedelta(days=performance_window)
+    dirty = pd.Series(False, index=asi_index)
+    # I ticker mai entrati in un paniere non influenzano l'ASI (il refresh registra tutti i file riscritti)
+    basket_tickers = {ticker for basket in baskets.values() for ticker in basket} | {BTC_TICKER}
+
+    for change in dirty_ranges.itertuples(index=False):
+        if change.ticker not in basket_tickers:
+            continue
+        overlaps = (window_start <= change.end) & (asi_index >= change.start)
+        if not overlaps.any():
+            continue
+        if change.ticker == BTC_TICKER:
+            dirty |= overlaps
+        else:
+            depends = [change.ticker in baskets.get(key, ()) for key in keys]
+            dirty |= overlaps & pd.Series(depends, index=asi_index)
+
+    if changed_basket_dates:
+        dirty |= pd.Series([key in changed_basket_dates for key in keys], index=asi_index)
+    return asi_index[dirty.to_numpy()]
+
+def dirty_blocks(index: pd.DatetimeIndex, dirty_dates: pd.DatetimeIndex) -> List[pd.DatetimeIndex]:
+    """Raggruppa le date sporche in blocchi di righe consecutive di `index`."""
+    positions = np.sort(index.get_indexer(dirty_dates))
+    positions = positions[positions >= 0]
+    if len(positions) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(positions) > 1) + 1
+    return [index[block] for block in np.split(positions, breaks)]
+
+def recompute_dirty_asi(asi_df: pd.DataFrame, historical_data: pd.DataFrame, baskets: Dict[str, list],
+                        dirty_dates: pd.DatetimeIndex, performance_window: int = 90, n_jobs: int = 1,
+                        shard_size: Optional[int] = None) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Ricalcola l'ASI solo per `dirty_dates`, un blocco di date consecutive alla volta: per ogni blocco vengono
+    lette le sole righe dei close necessarie alle sue finestre, quindi intervalli sparsi non ricalcolano le
+    date pulite che li separano. Le date di historical_data successive all'ultima data dell'ASI vengono
+    trattate come sporche. `n_jobs` e `shard_size` vengono passati a calculate_full_asi per ogni blocco.
+    Ritorna (ASI aggiornato, statistiche {'invalidated', 'reused', 'total', 'blocks'}).
+    """
+    new_dates = historical_data.index[historical_data.index > asi_df.index.max()]
+    dirty_dates = pd.DatetimeIndex(dirty_dates).union(new_dates)
+    merged = asi_df.reindex(asi_df.index.union(new_dates))
+    merged['performance_window'] = performance_window
+
+    blocks = dirty_blocks(historical_data.index, dirty_dates)
+    recomputed = [calculate_full_asi(historical_data.loc[block[0] - pd.Timedelta(days=performance_window):block[-1]],
+                                     baskets, performance_window, n_jobs, shard_size).loc[block]
+                  for block in blocks]
+    # Le date sporche senza dati storici restano senza valore e vengono scartate
+    recomputed = pd.concat(recomputed).reindex(dirty_dates) if recomputed else pd.DataFrame(index=dirty_dates)
+    for column in ('index_value', 'outperforming_count', 'basket_size'):
+        merged.loc[dirty_dates, column] = recomputed[column] if column in recomputed.columns else np.nan
+
+    merged = merged.dropna(subset=['index_value'])
+    stats = {
+        'invalidated': int(len(dirty_dates)),
+        'reused': int(len(merged.index.difference(dirty_dates))),
+        'total': int(len(merged)),
+        'blocks': len(blocks),
+    }
+    logger.info(f"Ricalcolo ASI: {stats['invalidated']} righe invalidate in {stats['blocks']} blocchi, {stats['reused']} riutilizzate.")
+    return merged, stats
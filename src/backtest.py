@@ -0,0 +1,160 @@
+# src/backtest.py
+
+import time
+import logging
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Sequence, Tuple
+
+from src.asi_indicator_calculator import ASI_REGIME_LABELS, RSI_PHASE_LABELS, SLOPE_PHASE_LABELS
+from src.data_processing import _prepare_asi_inputs
+from src.rule_engine import RuleSet, amount_table
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_ASSETS = ('BTC', 'Basket')
+BACKTEST_SUMMARY_FILE_NAME = 'allocation_backtest_summary.parquet'
+BACKTEST_EQUITY_FILE_NAME = 'allocation_backtest_equity.parquet'
+
+class BacktestResult(NamedTuple):
+    """
+    Risultato di un backtest di allocazione.
+    Campi:
+        equity: Valore del portafoglio per data (colonne MultiIndex: variante, asset)
+        invested: Capitale versato cumulato per data (colonne: variante)
+        summary: Statistiche per (variante, asset): versato, valore finale, rendimento, max drawdown
+    """
+    equity: pd.DataFrame
+    invested: pd.DataFrame
+    summary: pd.DataFrame
+
+def asset_returns(historical_data: pd.DataFrame, baskets: dict) -> pd.DataFrame:
+    """
+    Rendimenti giornalieri degli asset su cui viene investito il capitale:
+    - BTC: rendimento di Bitcoin
+    - Basket: media equipesata dei rendimenti delle altcoin del paniere del giorno (con dati disponibili)
+    Riusa la matrice dei rendimenti e la maschera dei panieri del calcolo dell'ASI. NaN dove non ci sono dati.
+    """
+    inputs = _prepare_asi_inputs(historical_data, baskets)
+    returns = inputs['returns']
+    valid = inputs['return_counts'] > 0
+
+    members = (inputs['ranks'] < inputs['basket_len'][:, None]) & valid
+    members[:, 0] = False  # la colonna 0 è BTC: il paniere è di sole altcoin
+    member_count = members.sum(axis=1)
+    basket = np.where(member_count > 0, np.where(members, returns, 0.0).sum(axis=1) / np.maximum(member_count, 1), np.nan)
+    btc = np.where(valid[:, 0], returns[:, 0], np.nan)
+    return pd.DataFrame({'BTC': btc, 'Basket': basket}, index=historical_data.index)
+
+def phase_codes(indicators_df: pd.DataFrame) -> np.ndarray:
+    """
+    Codice di fase per data (asi * 9 + rsi * 3 + slope, come in PHASE_COMBINATIONS); -1 se una fase manca.
+    Accetta sia le colonne categoriche di calculate_asi_indicators sia stringhe (es. da Parquet).
+    """
+    codes = np.zeros(len(indicators_df), dtype=np.int64)
+    missing = np.zeros(len(indicators_df), dtype=bool)
+    for column, labels, weight in (('asi_regime', ASI_REGIME_LABELS, 9),
+                                   ('rsi_phase', RSI_PHASE_LABELS, 3),
+                                   ('slope_phase', SLOPE_PHASE_LABELS, 1)):
+        column_codes = pd.Categorical(indicators_df[column], categories=labels).codes.astype(np.int64)
+        missing |= column_codes < 0
+        codes += column_codes * weight
+    codes[missing] = -1
+    return codes
+
+def _simulate(codes: np.ndarray, deploy_mask: np.ndarray, tables: np.ndarray, growth: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Simula tutte le varianti in un colpo solo.
+    Args:
+        codes: Codici di fase (T,), -1 dove le fasi mancano (nessun versamento)
+        deploy_mask: Date di versamento (T,)
+        tables: Importi per codice di fase, una riga per variante (V, 27)
+        growth: Crescita cumulata di ciascun asset (A, T)
+    Returns:
+        (valori (V, A, T), versato cumulato (V, T)).
+    Con V_t = V_{t-1} * (1 + r_t) + c_t e G_t = prod(1 + r), il valore è V_t = G_t * cumsum(c / G)_t:
+    nessun ciclo sulle date.
+    """
+    contributions = np.where((codes >= 0) & deploy_mask, tables[:, np.maximum(codes, 0)], 0.0)
+    invested = np.cumsum(contributions, axis=1)
+    values = growth[None, :, :] * np.cumsum(contributions[:, None, :] / growth[None, :, :], axis=2)
+    return values, invested
+
+def _max_drawdown(values: np.ndarray, invested: np.ndarray) -> np.ndarray:
+    """
+    Max drawdown (<= 0) del rapporto valore / versato sull'ultimo asse:
+    i versamenti non vengono scambiati per guadagni.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(invested > 0, values / invested, np.nan)
+        drawdown = ratio / np.fmax.accumulate(ratio, axis=-1) - 1
+    return np.where(np.isnan(drawdown), 0.0, drawdown).min(axis=-1)
+
+def run_backtest(indicators_df: pd.DataFrame, returns_df: pd.DataFrame, rule_sets: Sequence[RuleSet],
+                 deploy_freq: str = '7D', n_jobs: int = 1) -> BacktestResult:
+    """
+    Backtest storico dell'allocazione di capitale guidata dalle regole di boost.
+    Ogni `deploy_freq` (a partire dalla prima data con tutte le fasi disponibili) viene versato l'importo
+    che la variante assegna alla combinazione di fasi del giorno, investito al close su ciascun asset.
+    Nei giorni senza dati di un asset il capitale resta fermo.
+
+    Args:
+        indicators_df: Output di calculate_asi_indicators (indice temporale, colonne delle fasi)
+        returns_df: Rendimenti giornalieri per asset (es. asset_returns)
+        rule_sets: Varianti di regole da valutare (nomi univoci)
+        deploy_freq: Frequenza dei versamenti (offset pandas, es. '7D', '30D')
+        n_jobs: Con n_jobs > 1 le varianti sono divise in blocchi simulati in un pool di processi
+    """
+    names = [rules.name for rules in rule_sets]
+    if len(set(names)) != len(names):
+        raise ValueError("I nomi delle varianti di regole devono essere univoci.")
+
+    index = indicators_df.index.intersection(returns_df.index).rename('date')
+    codes = phase_codes(indicators_df.loc[index])
+    if not (codes >= 0).any():
+        raise ValueError("Nessuna data con tutte le fasi degli indicatori disponibili.")
+    first = index[np.argmax(codes >= 0)]
+    index, codes = index[index >= first], codes[index >= first]
+    deploy_mask = index.isin(pd.date_range(start=first, end=index[-1], freq=deploy_freq))
+
+    returns = returns_df.loc[index, list(BACKTEST_ASSETS)].to_numpy(dtype=np.float64).T
+    growth = np.cumprod(1 + np.nan_to_num(returns), axis=1)
+    tables = np.stack([amount_table(rules) for rules in rule_sets])
+
+    started = time.perf_counter()
+    if n_jobs > 1 and len(rule_sets) > 1:
+        chunks = np.array_split(np.arange(len(rule_sets)), min(n_jobs, len(rule_sets)))
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_simulate, codes, deploy_mask, tables[chunk], growth) for chunk in chunks]
+            results = [future.result() for future in futures]
+        values = np.concatenate([result[0] for result in results])
+        invested = np.concatenate([result[1] for result in results])
+    else:
+        values, invested = _simulate(codes, deploy_mask, tables, growth)
+    logger.info(f"Backtest: {len(rule_sets)} varianti x {len(index)} date in {time.perf_counter() - started:.2f}s")
+
+    equity = pd.DataFrame(values.transpose(2, 0, 1).reshape(len(index), -1), index=index,
+                          columns=pd.MultiIndex.from_product([names, BACKTEST_ASSETS], names=['variant', 'asset']))
+    invested_df = pd.DataFrame(invested.T, index=index, columns=pd.Index(names, name='variant'))
+
+    final_invested = np.repeat(invested[:, -1], len(BACKTEST_ASSETS))
+    final_value = values[:, :, -1].ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_return = np.where(final_invested > 0, final_value / final_invested - 1, np.nan)
+    summary = pd.DataFrame({
+        'variant': np.repeat(names, len(BACKTEST_ASSETS)),
+        'asset': np.tile(BACKTEST_ASSETS, len(names)),
+        'contributions': np.repeat(np.count_nonzero(np.diff(invested, axis=1, prepend=0.0), axis=1), len(BACKTEST_ASSETS)),
+        'invested': final_invested,
+        'final_value': final_value,
+        'total_return': total_return,
+        'max_drawdown': _max_drawdown(values, invested[:, None, :]).ravel(),
+    })
+    return BacktestResult(equity=equity, invested=invested_df, summary=summary)
+
+def equity_long_format(result: BacktestResult) -> pd.DataFrame:
+    """Curve di equity in formato lungo (date, variant, asset, value, invested), per il salvataggio in Parquet."""
+    equity = result.equity.stack(level=['variant', 'asset']).rename('value').reset_index()
+    invested = result.invested.stack().rename('invested').reset_index()
+    return equity.merge(invested, on=['date', 'variant'], how='left')
@@ -0,0 +1,50 @@
+# src/chart_utils.py
+
+import numpy as np
+import pandas as pd
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: seleziona `threshold` punti che preservano la forma della serie
+    (picchi e minimi inclusi). Il primo e l'ultimo punto sono sempre mantenuti.
+
+    Args:
+        x: Ascisse numeriche crescenti.
+        y: Ordinate (senza NaN).
+        threshold: Numero di punti desiderati.
+
+    Returns:
+        Array ordinato con le posizioni dei punti selezionati.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # Bucket interni (primo e ultimo punto esclusi)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Media del bucket successivo come terzo vertice del triangolo
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+def downsample_series(series: pd.Series, max_points: int) -> pd.Series:
+    """Riduce una serie temporale a `max_points` punti con LTTB, scartando i NaN."""
+    series = series.dropna()
+    if len(series) <= max_points:
+        return series
+    x = series.index.asi8 if isinstance(series.index, pd.DatetimeIndex) else np.asarray(series.index, dtype=np.float64)
+    return series.iloc[lttb_indices(x, series.to_numpy(), max_points)]
@@ -2,9 +2,9 @@ import streamlit as st
 import pandas as pd
 import traceback
 import io
-from googleapiclient.http import MediaIoBaseDownload
 
 from src.gdrive_service import get_gdrive_service, find_id, download_parquet
+from src.data_processing import ASI_VARIANTS_FILE_NAME
 
 @st.cache_data(ttl=3600)
 def load_production_asi() -> pd.DataFrame:
@@ -52,6 +52,7 @@ def load_production_asi() -> pd.DataFrame:
         # Ora ispezioniamo il file per capire perché.
         st.warning("Lettura del file Parquet fallita. Ispezione del contenuto grezzo del file...")
         
+        from googleapiclient.http import MediaIoBaseDownload
         request = service.files().get_media(fileId=asi_file_id)
         file_buffer = io.BytesIO()
         downloader = MediaIoBaseDownload(file_buffer, request)
@@ -73,3 +74,28 @@ def load_production_asi() -> pd.DataFrame:
         st.subheader("Traceback Completo dell'Errore")
         st.code(traceback.format_exc())
         return None
+
+@st.cache_data(ttl=3600)
+def load_production_asi_variants() -> pd.DataFrame:
+    """
+    Scarica il file Parquet (formato long) con le varianti dell'ASI calcolate in un unico passaggio.
+    Ritorna un DataFrame vuoto se il file non esiste ancora: la dashboard usa allora solo l'ASI di produzione.
+    """
+    try:
+        sa_key = st.secrets["GDRIVE_SA_KEY"]
+        service = get_gdrive_service(sa_key)
+
+        root_folder_id = find_id(service, name="KriterionQuant_Data", mime_type='application/vnd.google-apps.folder')
+        prod_folder_id = find_id(service, name="production", parent_id=root_folder_id, mime_type='application/vnd.google-apps.folder') if root_folder_id else None
+        variants_file_id = find_id(service, name=ASI_VARIANTS_FILE_NAME, parent_id=prod_folder_id) if prod_folder_id else None
+        if not variants_file_id:
+            return pd.DataFrame()
+
+        df = download_parquet(service, variants_file_id)
+        if df is None or df.empty or not {'date', 'variant', 'index_value'}.issubset(df.columns):
+            return pd.DataFrame()
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+    except Exception as e:
+        st.warning(f"Varianti ASI non disponibili: {e}")
+        return pd.DataFrame()
@@ -1,22 +1,52 @@
+import os
+import tempfile
+import time
 import pandas as pd
+import numpy as np
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
+from typing import List, NamedTuple, Optional
 
 # Configura il logging
 logger = logging.getLogger(__name__)
 
-def create_dynamic_baskets(df, top_n=50, lookback_days=30, rebalancing_freq='90D'):
+BTC_TICKER = 'BTC-USD.CC'
+ASI_METHODS = ('mean', 'cumulative')
+ASI_VARIANTS_FILE_NAME = 'altcoin_season_index_variants.parquet'
+BASKET_HISTORY_FILE_NAME = 'basket_history.parquet'
+BASKET_HISTORY_COLUMNS = ['rebalance_date', 'rank', 'ticker', 'top_n', 'lookback_days', 'rebalancing_freq']
+BASKET_START_DATE = pd.Timestamp('2018-05-01')
+
+class ASIVariant(NamedTuple):
     """
-    Crea panieri dinamici di altcoin basati sul volume su una finestra temporale.
-    Parametri:
-        df: DataFrame con i dati storici (indice temporale o colonna 'date', colonne: ticker, close, volume)
-        top_n: Numero di altcoin da includere nei panieri
-        lookback_days: Finestra temporale per calcolare il volume
-        rebalancing_freq: Frequenza di ribilanciamento dei panieri (es. '90D' per 90 giorni)
+    Specifica di una variante dell'ASI.
+    Campi:
+        name: Nome univoco della variante (usato dalla dashboard)
+        performance_window: Finestra di performance in giorni
+        top_n: Numero di altcoin del paniere considerate (prefisso della lista ordinata per volume)
+        method: 'mean' (media dei rendimenti giornalieri) o 'cumulative' (rendimento cumulato)
     """
-    logger.info(f"Parametri panieri: top_n={top_n}, lookback_days={lookback_days}, rebalancing_freq={rebalancing_freq}")
-    
-    # Verifica e converti l'indice in DatetimeIndex se necessario
+    name: str
+    performance_window: int = 90
+    top_n: int = 50
+    method: str = 'mean'
+
+def build_historical_frames(data_dict):
+    """
+    Converte il dizionario {ticker: DataFrame(close, volume)} di download_all_parquets_in_folder
+    nei due formati usati dalla pipeline.
+    Ritorna:
+        (matrice dei close date x ticker per calculate_full_asi,
+         DataFrame long con colonne ticker, close, volume per create_dynamic_baskets)
+    """
+    closes = pd.DataFrame({ticker: df['close'] for ticker, df in data_dict.items()}).sort_index()
+    long_df = pd.concat([df[['close', 'volume']].assign(ticker=ticker) for ticker, df in data_dict.items()]).sort_index(kind='stable')
+    long_df.index.name = 'date'
+    return closes, long_df
+
+def _ensure_datetime_index(df):
+    """Verifica e converte l'indice in DatetimeIndex ordinato, se necessario."""
     if not isinstance(df.index, pd.DatetimeIndex):
         logger.warning("L'indice non è un DatetimeIndex. Conversione in corso...")
         if 'date' in df.columns:
@@ -25,89 +55,415 @@ def create_dynamic_baskets(df, top_n=50, lookback_days=30, rebalancing_freq='90D
             logger.info("Indice convertito con successo usando la colonna 'date'")
         else:
             raise ValueError("Il DataFrame non ha una colonna 'date' e l'indice non è un DatetimeIndex")
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind='stable')
+    return df
+
+def _select_top_tickers(df, rebalance_date, top_n, lookback_days):
+    """Seleziona i top_n ticker per volume nella finestra di lookback che precede `rebalance_date`."""
+    lookback_end = rebalance_date - timedelta(days=1)
+    lookback_start = lookback_end - timedelta(days=lookback_days)
+    
+    # Assicurati che le date siano nell'intervallo del DataFrame
+    if lookback_start < df.index.min():
+        lookback_start = df.index.min()
+    if lookback_end > df.index.max():
+        lookback_end = df.index.max()
     
-    logger.info(f"Struttura del DataFrame: {df.index}, colonne: {df.columns.tolist()}")
+    # Filtra i dati per la finestra temporale
+    window_data = df.loc[lookback_start:lookback_end]
+    if window_data.empty:
+        logger.warning(f"Nessun dato disponibile per la finestra {lookback_start} a {lookback_end}")
+        return None
     
-    # Definisci il range delle date basato sui dati disponibili
-    start_date = df.index.min()
-    end_date = df.index.max()
-    dates = pd.date_range(start=max(start_date, pd.Timestamp('2018-05-01')), 
-                          end=min(end_date, pd.Timestamp('2025-06-27')), 
-                          freq='D')
-    rebalance_dates = pd.date_range(start=dates.min(), end=dates.max(), freq=rebalancing_freq)
+    # Calcola il volume totale per ticker
+    volume_by_ticker = window_data.groupby(level='ticker')['volume'].sum() if 'ticker' in window_data.index.names else window_data.groupby('ticker')['volume'].sum()
+    return volume_by_ticker.nlargest(top_n).index.tolist()
 
-    baskets = {}
-    for rebalance_date in rebalance_dates:
-        lookback_end = rebalance_date - timedelta(days=1)
-        lookback_start = lookback_end - timedelta(days=lookback_days)
-        
-        # Assicurati che le date siano nell'intervallo del DataFrame
-        if lookback_start < df.index.min():
-            lookback_start = df.index.min()
-        if lookback_end > df.index.max():
-            lookback_end = df.index.max()
-        
-        # Filtra i dati per la finestra temporale
-        window_data = df.loc[lookback_start:lookback_end].copy()
-        if window_data.empty:
-            logger.warning(f"Nessun dato disponibile per la finestra {lookback_start} a {lookback_end}")
+def _history_matches(basket_history, top_n, lookback_days, rebalancing_freq):
+    """Verifica che lo storico panieri salvato sia stato generato con gli stessi parametri."""
+    if basket_history is None or basket_history.empty:
+        return False
+    params = basket_history[['top_n', 'lookback_days', 'rebalancing_freq']].drop_duplicates()
+    return (len(params) == 1
+            and int(params['top_n'].iloc[0]) == top_n
+            and int(params['lookback_days'].iloc[0]) == lookback_days
+            and params['rebalancing_freq'].iloc[0] == rebalancing_freq)
+
+def rebalance_schedule(first_date, as_of, rebalancing_freq='90D') -> pd.DatetimeIndex:
+    """Calendario completo dei ribilanciamenti: da BASKET_START_DATE (o dal primo dato) fino ad `as_of`."""
+    anchor = max(pd.Timestamp(first_date), BASKET_START_DATE)
+    return pd.date_range(start=anchor, end=pd.Timestamp(as_of), freq=rebalancing_freq)
+
+def extend_basket_history(df, basket_history=None, top_n=50, lookback_days=30, rebalancing_freq='90D', as_of=None) -> pd.DataFrame:
+    """
+    Estende lo storico dei panieri con i soli ribilanciamenti diventati dovuti.
+    Il calendario dei ribilanciamenti parte da BASKET_START_DATE (o dal primo dato disponibile) e avanza
+    di `rebalancing_freq`: ad ogni esecuzione vengono calcolate solo le date successive all'ultimo
+    ribilanciamento salvato, leggendo unicamente la finestra di volume di `lookback_days` giorni.
+    Parametri:
+        df: DataFrame con i dati storici (indice temporale o colonna 'date', colonne: ticker, close, volume)
+        basket_history: Storico panieri salvato (colonne BASKET_HISTORY_COLUMNS) o None per rigenerarlo
+        top_n: Numero di altcoin da includere nei panieri
+        lookback_days: Finestra temporale per calcolare il volume
+        rebalancing_freq: Frequenza di ribilanciamento dei panieri (es. '90D' per 90 giorni)
+        as_of: Data fino alla quale calcolare i ribilanciamenti dovuti (default: ultima data di df)
+    Ritorna:
+        Storico panieri aggiornato, una riga per (rebalance_date, rank).
+    """
+    df = _ensure_datetime_index(df)
+    as_of = pd.Timestamp(as_of) if as_of is not None else df.index.max()
+
+    if _history_matches(basket_history, top_n, lookback_days, rebalancing_freq):
+        last_rebalance = pd.Timestamp(basket_history['rebalance_date'].max())
+        due_dates = pd.date_range(start=last_rebalance, end=as_of, freq=rebalancing_freq)[1:]
+    else:
+        if basket_history is not None and not basket_history.empty:
+            logger.warning("Parametri dello storico panieri cambiati: rigenerazione completa del calendario.")
+        basket_history = pd.DataFrame(columns=BASKET_HISTORY_COLUMNS)
+        due_dates = rebalance_schedule(df.index.min(), as_of, rebalancing_freq)
+
+    new_rows = []
+    for rebalance_date in due_dates:
+        top_tickers = _select_top_tickers(df, rebalance_date, top_n, lookback_days)
+        if top_tickers is None:
             continue
-        
-        # Calcola il volume totale per ticker
-        volume_by_ticker = window_data.groupby(level='ticker')['volume'].sum() if 'ticker' in window_data.index.names else window_data.groupby('ticker')['volume'].sum()
-        top_tickers = volume_by_ticker.nlargest(top_n).index
-        
-        # Assegna i ticker al paniere per tutte le date fino alla prossima ribilanciamento
-        next_rebalance = rebalance_dates[rebalance_dates.get_loc(rebalance_date) + 1] if rebalance_date != rebalance_dates[-1] else end_date
-        dates_in_range = dates[(dates >= rebalance_date) & (dates < next_rebalance)]
-        for date in dates_in_range:
-            baskets[date.strftime('%Y-%m-%d')] = top_tickers.tolist()
-    
-    logger.info(f"Panieri generati: {len(baskets)} panieri, esempio per 2025-06-27: {baskets.get('2025-06-27')}")
+        for rank, ticker in enumerate(top_tickers):
+            new_rows.append((rebalance_date, rank, ticker, top_n, lookback_days, rebalancing_freq))
+
+    logger.info(f"Ribilanciamenti dovuti: {len(due_dates)}, nuove righe nello storico panieri: {len(new_rows)}")
+    if not new_rows:
+        return basket_history
+    new_history = pd.DataFrame(new_rows, columns=BASKET_HISTORY_COLUMNS)
+    if basket_history.empty:
+        return new_history
+    return pd.concat([basket_history, new_history], ignore_index=True)
+
+def baskets_from_history(basket_history, end_date, rebalancing_freq=None) -> dict:
+    """
+    Espande lo storico dei panieri nel dizionario giornaliero {data: [ticker, ...]}.
+    Ogni paniere resta valido fino al ribilanciamento successivo; l'ultimo fino a `end_date` incluso.
+    """
+    if basket_history is None or basket_history.empty:
+        return {}
+    if rebalancing_freq is None:
+        rebalancing_freq = basket_history['rebalancing_freq'].iloc[0]
+    freq_offset = pd.tseries.frequencies.to_offset(rebalancing_freq)
+    end_date = pd.Timestamp(end_date)
+
+    ordered = basket_history.sort_values(['rebalance_date', 'rank'])
+    grouped = list(ordered.groupby('rebalance_date', sort=True)['ticker'])
+    baskets = {}
+    for i, (rebalance_date, tickers) in enumerate(grouped):
+        rebalance_date = pd.Timestamp(rebalance_date)
+        range_end = end_date + timedelta(days=1) if i == len(grouped) - 1 else min(grouped[i + 1][0], rebalance_date + freq_offset)
+        top_tickers = tickers.tolist()
+        for date in pd.date_range(start=rebalance_date, end=range_end, freq='D', inclusive='left'):
+            baskets[date.strftime('%Y-%m-%d')] = top_tickers
     return baskets
 
-def calculate_full_asi(historical_data, baskets, performance_window=90):
+def create_dynamic_baskets(df, top_n=50, lookback_days=30, rebalancing_freq='90D', basket_history=None):
+    """
+    Crea panieri dinamici di altcoin basati sul volume su una finestra temporale.
+    Con lo storico panieri salvato calcola solo i ribilanciamenti dovuti dopo l'ultimo;
+    senza storico rigenera l'intero calendario.
+    Parametri:
+        df: DataFrame con i dati storici (indice temporale o colonna 'date', colonne: ticker, close, volume)
+        top_n: Numero di altcoin da includere nei panieri
+        lookback_days: Finestra temporale per calcolare il volume
+        rebalancing_freq: Frequenza di ribilanciamento dei panieri (es. '90D' per 90 giorni)
+        basket_history: Storico panieri salvato (colonne BASKET_HISTORY_COLUMNS), es. da update_basket_history_on_drive
+    """
+    logger.info(f"Parametri panieri: top_n={top_n}, lookback_days={lookback_days}, rebalancing_freq={rebalancing_freq}")
+    df = _ensure_datetime_index(df)
+    basket_history = extend_basket_history(df, basket_history, top_n, lookback_days, rebalancing_freq)
+    baskets = baskets_from_history(basket_history, df.index.max(), rebalancing_freq)
+    last_key = df.index.max().strftime('%Y-%m-%d')
+    logger.info(f"Panieri generati: {len(baskets)} panieri, esempio per {last_key}: {baskets.get(last_key)}")
+    return baskets
+
+def download_basket_history(service, folder_id) -> Optional[pd.DataFrame]:
+    """Scarica lo storico panieri salvato su Google Drive (None se assente o vuoto)."""
+    from src.gdrive_service import find_id, download_parquet
+
+    file_id = find_id(service, name=BASKET_HISTORY_FILE_NAME, parent_id=folder_id)
+    stored_history = download_parquet(service, file_id) if file_id else None
+    if stored_history is None or stored_history.empty:
+        return None
+    stored_history['rebalance_date'] = pd.to_datetime(stored_history['rebalance_date'])
+    return stored_history
+
+def update_basket_history_on_drive(service, df, folder_id, top_n=50, lookback_days=30, rebalancing_freq='90D'):
+    """
+    Carica lo storico panieri da Google Drive, aggiunge i ribilanciamenti dovuti e lo risalva
+    solo se è cambiato. Ritorna (storico aggiornato, dizionario dei panieri giornalieri).
+    """
+    from src.gdrive_service import upload_or_update_parquet
+
+    stored_history = download_basket_history(service, folder_id)
+    df = _ensure_datetime_index(df)
+    basket_history = extend_basket_history(df, stored_history, top_n, lookback_days, rebalancing_freq)
+    if basket_history is not stored_history and not basket_history.empty:
+        upload_or_update_parquet(service, basket_history, BASKET_HISTORY_FILE_NAME, folder_id)
+    return basket_history, baskets_from_history(basket_history, df.index.max(), rebalancing_freq)
+
+def _basket_ranks(index, baskets, tickers):
+    """
+    Costruisce la maschera dei panieri come matrice di rank (date x ticker).
+    Il rank è la posizione del ticker nella lista del paniere (ordinata per volume),
+    quindi il top-N di un paniere è semplicemente `ranks < N`.
+    """
+    col_pos = {ticker: j for j, ticker in enumerate(tickers)}
+    ranks = np.full((len(index), len(tickers)), np.iinfo(np.int32).max, dtype=np.int32)
+    basket_len = np.zeros(len(index), dtype=np.int64)
+
+    # I panieri sono costanti tra due ribilanciamenti: calcoliamo le posizioni una volta per paniere
+    positions_cache = {}
+    for i, key in enumerate(index.strftime('%Y-%m-%d')):
+        basket = baskets.get(key)
+        if not basket:
+            continue
+        cache_key = tuple(basket)
+        if cache_key not in positions_cache:
+            cols = np.array([col_pos[t] for t in basket], dtype=np.int64)
+            positions_cache[cache_key] = (cols, np.arange(len(basket), dtype=np.int32))
+        cols, basket_rank = positions_cache[cache_key]
+        ranks[i, cols] = basket_rank
+        basket_len[i] = len(basket)
+    return ranks, basket_len
+
+def _window_sums(values, starts):
+    """
+    Somma dei valori delle righe (starts[i], i] per ogni riga i: i rendimenti della finestra
+    [date - performance_window, date], esclusa la prima riga che non ha un rendimento interno alla finestra.
+    Ogni finestra è ridotta in modo indipendente (niente somme cumulative), quindi il risultato di una data
+    dipende solo dai valori della sua finestra.
+    """
+    n_rows = len(values)
+    padded = np.concatenate([values, np.zeros((1,) + values.shape[1:])])
+    bounds = np.column_stack([starts + 1, np.arange(n_rows) + 1]).ravel()
+    sums = np.add.reduceat(padded, bounds, axis=0)[::2]
+    # reduceat su un intervallo vuoto restituisce l'elemento iniziale invece di zero
+    sums[starts == np.arange(n_rows)] = 0.0
+    return sums
+
+def _leading_gap_correction(inputs, starts):
+    """
+    Il rendimento calcolato sulla serie intera (ffill globale) può usare un close precedente alla finestra:
+    se le prime righe della finestra di un ticker sono NaN, la prima barra valida produce un rendimento
+    rispetto a un prezzo fuori finestra e le righe NaN precedenti dei rendimenti nulli. Il ciclo per data
+    originale faceva il pad solo dentro la finestra e non contava né gli uni né gli altri.
+    Ritorna (rendimenti da escludere per finestra, posizione della barra da escludere o -1).
+    """
+    n_rows = len(starts)
+    rows = np.arange(n_rows)
+    valid_close = np.diff(inputs['raw_counts'], axis=0) > 0
+    next_valid = np.where(valid_close, rows[:, None], n_rows)
+    next_valid = np.minimum.accumulate(next_valid[::-1], axis=0)[::-1]
+    first_valid = next_valid[starts]
+
+    # Esiste un close valido prima della finestra se il rendimento della riga successiva all'inizio è valido
+    has_prior = inputs['return_counts'][np.minimum(starts + 1, n_rows - 1)] > 0
+    leaked = has_prior & (first_valid > starts[:, None])
+    excluded = np.where(leaked, np.minimum(first_valid, rows[:, None]) - starts[:, None], 0)
+    leaked_row = np.where(leaked & (first_valid <= rows[:, None]), first_valid, -1)
+    return excluded.astype(np.float64), leaked_row
+
+def _exclude_leaked(values, sums, leaked_row):
+    """Toglie dalle somme di finestra il rendimento della barra calcolato su un close fuori finestra."""
+    columns = np.arange(values.shape[1])
+    leaked = values[np.maximum(leaked_row, 0), columns]
+    return np.where(leaked_row >= 0, sums - leaked, sums)
+
+def _prepare_asi_inputs(historical_data, baskets):
+    """
+    Prepara gli input condivisi da tutte le varianti: matrice dei rendimenti, conteggi dei dati
+    validi e maschera dei panieri. Vengono considerati solo i ticker che compaiono in almeno un paniere.
+    """
+    basket_tickers = {t for basket in baskets.values() for t in basket}
+    tickers = [BTC_TICKER] + sorted(basket_tickers - {BTC_TICKER})
+    closes = historical_data.reindex(columns=tickers)
+
+    # ffill + pct_change riproduce il comportamento storico di pct_change() (fill_method='pad');
+    # i rendimenti che attraversano l'inizio di una finestra vengono esclusi da _leading_gap_correction
+    returns = closes.ffill().pct_change(fill_method=None).to_numpy(dtype=np.float64)
+    return_valid = ~np.isnan(returns)
+
+    # Conteggio cumulativo dei close non-NaN: serve per escludere i ticker senza dati nella finestra
+    raw_counts = np.zeros((len(closes) + 1, len(tickers)), dtype=np.int64)
+    np.cumsum(closes.notna().to_numpy(), axis=0, out=raw_counts[1:])
+
+    ranks, basket_len = _basket_ranks(historical_data.index, baskets, tickers)
+    return {
+        'tickers': tickers,
+        'returns': np.where(return_valid, returns, 0.0),
+        'log_returns': np.where(return_valid, np.log1p(np.where(return_valid, returns, 0.0)), 0.0),
+        'return_counts': return_valid.astype(np.float64),
+        'raw_counts': raw_counts,
+        'ranks': ranks,
+        'basket_len': basket_len,
+    }
+
+def _window_start_positions(index, performance_window):
+    """Posizione della prima riga di ogni finestra [date - performance_window, date]."""
+    return index.searchsorted(index - pd.Timedelta(days=performance_window), side='left')
+
+def _compute_variant(inputs, index, variant, window_cache):
+    """Calcola una singola variante riusando gli aggregati mobili già presenti in `window_cache`."""
+    pw = variant.performance_window
+    if pw not in window_cache:
+        starts = _window_start_positions(index, pw)
+        positions = np.arange(len(index))
+        excluded, leaked_row = _leading_gap_correction(inputs, starts)
+        window_cache[pw] = {
+            'starts': starts,
+            'leaked_row': leaked_row,
+            'slice_len': positions - starts + 1,
+            'raw_counts': inputs['raw_counts'][positions + 1] - inputs['raw_counts'][starts],
+            'return_counts': _window_sums(inputs['return_counts'], starts) - excluded,
+        }
+    window = window_cache[pw]
+
+    if variant.method == 'mean':
+        key = ('sum', pw)
+        if key not in window_cache:
+            window_cache[key] = _exclude_leaked(inputs['returns'], _window_sums(inputs['returns'], window['starts']), window['leaked_row'])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            perf = np.where(window['return_counts'] > 0, window_cache[key] / window['return_counts'], np.nan)
+    else:
+        # Il confronto dei rendimenti cumulati equivale al confronto delle somme dei log-rendimenti
+        key = ('log', pw)
+        if key not in window_cache:
+            window_cache[key] = _exclude_leaked(inputs['log_returns'], _window_sums(inputs['log_returns'], window['starts']), window['leaked_row'])
+        perf = np.where(window['return_counts'] > 0, window_cache[key], np.nan)
+
+    btc_perf = perf[:, 0]
+    with np.errstate(invalid='ignore'):
+        outperforms = (perf > btc_perf[:, None]) & (window['raw_counts'] > 0) & (inputs['ranks'] < variant.top_n)
+    outperforming = outperforms.sum(axis=1).astype(np.float64)
+    basket_size = np.minimum(inputs['basket_len'], variant.top_n).astype(np.float64)
+
+    valid = (basket_size > 0) & (window['slice_len'] >= pw) & (window['raw_counts'][:, 0] > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        index_value = np.where(valid, outperforming / basket_size * 100, np.nan)
+    return pd.DataFrame({
+        'index_value': index_value,
+        'outperforming_count': np.where(valid, outperforming, np.nan),
+        'basket_size': np.where(valid, basket_size, np.nan),
+    }, index=index)
+
+def calculate_asi_variants(historical_data, baskets, variants: List[ASIVariant]) -> pd.DataFrame:
+    """
+    Calcola più varianti dell'ASI in un solo passaggio sui dati storici.
+    La matrice dei rendimenti, gli aggregati mobili per ogni finestra distinta e la maschera
+    dei panieri sono calcolati una sola volta e condivisi tra le varianti.
+    Parametri:
+        historical_data: DataFrame con i dati storici (indice temporale, colonne: ticker)
+        baskets: Dizionario dei panieri dinamici (liste ordinate per volume decrescente)
+        variants: Lista di ASIVariant da calcolare
+    Ritorna:
+        DataFrame in formato long (date, variant, performance_window, top_n, method,
+        index_value, outperforming_count, basket_size) con le sole date calcolabili.
+    """
+    for variant in variants:
+        if variant.method not in ASI_METHODS:
+            raise ValueError(f"Metodo '{variant.method}' non valido per la variante '{variant.name}'. Valori ammessi: {ASI_METHODS}")
+    if len({variant.name for variant in variants}) != len(variants):
+        raise ValueError("I nomi delle varianti ASI devono essere univoci.")
+
+    logger.info(f"Calcolo di {len(variants)} varianti ASI: {[variant.name for variant in variants]}")
+    inputs = _prepare_asi_inputs(historical_data, baskets)
+    window_cache = {}
+
+    frames = []
+    for variant in variants:
+        variant_df = _compute_variant(inputs, historical_data.index, variant, window_cache).dropna(subset=['index_value'])
+        variant_df.index.name = 'date'
+        variant_df = variant_df.reset_index()
+        variant_df.insert(1, 'variant', variant.name)
+        variant_df.insert(2, 'performance_window', variant.performance_window)
+        variant_df.insert(3, 'top_n', variant.top_n)
+        variant_df.insert(4, 'method', variant.method)
+        frames.append(variant_df)
+        logger.info(f"Variante '{variant.name}': {len(variant_df)} date calcolate")
+
+    return pd.concat(frames, ignore_index=True)
+
+_SHARD_ARRAYS = ('returns', 'return_counts', 'raw_counts', 'ranks', 'basket_len')
+
+def _asi_shard_worker(input_dir, lo, start, end, performance_window):
+    """
+    Calcola l'ASI per le righe [start, end) leggendo da file memory-mapped le sole righe
+    [lo, end), dove lo è la prima riga della finestra [date - performance_window, date] della riga start.
+    Usa lo stesso codice del calcolo single-process, quindi il risultato è identico bit per bit.
+    """
+    started = time.perf_counter()
+    arrays = {name: np.load(os.path.join(input_dir, f'{name}.npy'), mmap_mode='r') for name in _SHARD_ARRAYS}
+    index = pd.DatetimeIndex(np.load(os.path.join(input_dir, 'index.npy'), mmap_mode='r')[lo:end])
+    inputs = {name: np.asarray(array[lo:end]) for name, array in arrays.items() if name != 'raw_counts'}
+    # raw_counts è cumulativo con una riga iniziale in più
+    inputs['raw_counts'] = np.asarray(arrays['raw_counts'][lo:end + 1])
+
+    variant = ASIVariant(name='default', performance_window=performance_window)
+    shard_df = _compute_variant(inputs, index, variant, {})
+    return start, shard_df.iloc[start - lo:], time.perf_counter() - started
+
+def _calculate_asi_sharded(inputs, index, performance_window, n_jobs, shard_size):
+    """
+    Divide l'asse delle date in shard di `shard_size` righe e li calcola in un pool di processi.
+    Gli input vengono scritti una volta su file .npy e letti dai worker via memory-map.
+    """
+    n_rows = len(index)
+    bounds = [(start, min(start + shard_size, n_rows)) for start in range(0, n_rows, shard_size)]
+    # Le finestre sono in giorni di calendario: con barre intraday o date mancanti
+    # la sovrapposizione in righe non coincide con performance_window
+    window_starts = _window_start_positions(index, performance_window)
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(prefix='asi_shards_') as input_dir:
+        for name in _SHARD_ARRAYS:
+            np.save(os.path.join(input_dir, f'{name}.npy'), np.ascontiguousarray(inputs[name]))
+        np.save(os.path.join(input_dir, 'index.npy'), index.values)
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_asi_shard_worker, input_dir, int(window_starts[start]), start, end, performance_window)
+                       for start, end in bounds]
+            shards = sorted((future.result() for future in futures), key=lambda shard: shard[0])
+
+    wall_seconds = time.perf_counter() - started
+    worker_seconds = sum(shard[2] for shard in shards)
+    efficiency = worker_seconds / (wall_seconds * n_jobs) if wall_seconds > 0 else 0.0
+    # Report stampato (non solo loggato): gli script non configurano il logging e serve a scegliere n_jobs/shard_size
+    print(f"ASI a shard: {len(bounds)} shard da {shard_size} righe su {n_jobs} processi, "
+          f"wall {wall_seconds:.2f}s, lavoro totale {worker_seconds:.2f}s, "
+          f"speedup {worker_seconds / wall_seconds if wall_seconds > 0 else 0.0:.2f}x, efficienza {efficiency:.0%}")
+    return pd.concat([shard[1] for shard in shards])
+
+def calculate_full_asi(historical_data, baskets, performance_window=90, n_jobs=1, shard_size=None):
     """
     Calcola l'ASI basato sulla performance delle altcoin rispetto a Bitcoin.
     Parametri:
         historical_data: DataFrame con i dati storici (indice temporale, colonne: ticker)
         baskets: Dizionario dei panieri dinamici
         performance_window: Finestra temporale per calcolare la performance (in giorni)
+        n_jobs: Numero di processi; con n_jobs > 1 (o shard_size indicato) l'asse delle date viene
+                diviso in shard calcolati in parallelo e ricuciti in un risultato identico al single-process
+        shard_size: Righe (date) per shard; default: divisione uniforme tra i processi
     """
     logger.info(f"Finestra performance ASI: {performance_window}")
-    asi_df = pd.DataFrame(index=historical_data.index)
-    
-    for date in historical_data.index:
-        basket = baskets.get(date.strftime('%Y-%m-%d'), [])
-        if len(basket) == 0:
-            continue
-        
-        # Calcola la performance media di Bitcoin su 90 giorni
-        btc_data = historical_data['BTC-USD.CC'].loc[date - timedelta(days=performance_window):date]
-        if len(btc_data) < performance_window or btc_data.isna().all():
-            logger.warning(f"Dati insufficienti per Bitcoin a {date}")
-            continue
-        btc_perf = btc_data.pct_change().mean()
-        
-        # Calcola la performance media per ogni altcoin nel paniere
-        outperforming = 0
-        basket_size = min(len(basket), 50)  # Limita a 50 come nel notebook
-        for alt in basket:
-            alt_data = historical_data[alt].loc[date - timedelta(days=performance_window):date]
-            if len(alt_data) < performance_window or alt_data.isna().all():
-                continue
-            alt_perf = alt_data.pct_change().mean()
-            if alt_perf > btc_perf:
-                outperforming += 1
-        
-        # Calcola l'ASI
-        asi = (outperforming / basket_size) * 100 if basket_size > 0 else 0
-        asi_df.loc[date, 'index_value'] = asi
-        asi_df.loc[date, 'outperforming_count'] = outperforming
-        asi_df.loc[date, 'basket_size'] = basket_size
-        
-        logger.info(f"ASI per {date}: {asi:.2f}% ({outperforming}/{basket_size} alts sovraperformanti)")
-    
+    inputs = _prepare_asi_inputs(historical_data, baskets)
+    # Senza date non c'è nulla da dividere: il percorso single-process restituisce il DataFrame vuoto
+    if (n_jobs > 1 or shard_size is not None) and len(historical_data.index) > 0:
+        shard_size = max(1, shard_size or -(-len(historical_data.index) // max(1, n_jobs)))
+        asi_df = _calculate_asi_sharded(inputs, historical_data.index, performance_window, max(1, n_jobs), shard_size)
+    else:
+        variant = ASIVariant(name='default', performance_window=performance_window)
+        asi_df = _compute_variant(inputs, historical_data.index, variant, {})
+
+    skipped = asi_df['index_value'].isna() & (inputs['basket_len'] > 0)
+    if skipped.any():
+        logger.warning(f"Dati insufficienti per Bitcoin in {int(skipped.sum())} date con paniere definito")
+
     # Verifica il valore finale per confronto con il notebook
     if '2025-06-27' in asi_df.index:
         logger.info(f"ASI finale per 2025-06-27: {asi_df.loc['2025-06-27', 'index_value']:.2f}%")
@@ -123,19 +479,16 @@ def fetch_daily_delta(tickers_list, api_key):
         api_key: Chiave API per EODHD
     """
     import requests
+    from src.normalization import normalize_eod_json, to_history_frame
     delta_dict = {}
     for ticker in tickers_list:
         try:
             url = f"https://eodhd.com/api/eod/{ticker}?api_token={api_key}&fmt=json&period=d"
             response = requests.get(url, timeout=30)
             response.raise_for_status()
-            data = response.json()
-            if data:
-                df = pd.DataFrame(data)
-                df['date'] = pd.to_datetime(df['date'], utc=True).dt.tz_localize(None)
-                df.set_index('date', inplace=True)
-                df = df[['close', 'volume']].dropna()
-                delta_dict[ticker] = df
+            table = normalize_eod_json(response.content)
+            if table.num_rows:
+                delta_dict[ticker] = to_history_frame(table)
             else:
                 logger.warning(f"Nessun dato restituito per {ticker}")
         except Exception as e:
@@ -1,19 +1,42 @@
 import io
 import json
+import threading
 import pandas as pd
 import time
-from typing import Optional, Dict
+from functools import lru_cache
+from typing import Optional, Dict, Iterator, Tuple
 
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-from googleapiclient.errors import HttpError
+# googleapiclient e google.auth sono importati solo quando serve davvero un client Drive:
+# gli entry point che non lo usano (o che colpiscono la cache di Streamlit) non ne pagano il costo.
+
+# I client googleapiclient (httplib2) non sono thread-safe: un servizio per thread, riusato per tutto il processo
+_thread_local = threading.local()
+
+@lru_cache(maxsize=1)
+def _drive_discovery_document() -> dict:
+    """Documento di discovery di Drive v3 statico (incluso in google-api-python-client), parsato una volta per processo."""
+    from googleapiclient.discovery_cache import get_static_doc
+    document = get_static_doc('drive', 'v3')
+    if document is None:
+        raise FileNotFoundError("Documento di discovery statico 'drive.v3' non trovato in googleapiclient.")
+    return json.loads(document)
+
+@lru_cache(maxsize=4)
+def _service_account_credentials(sa_key_string: str):
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_info(json.loads(sa_key_string))
 
 def get_gdrive_service(sa_key_string: str):
+    services = getattr(_thread_local, 'services', None)
+    if services is None:
+        services = _thread_local.services = {}
+    if sa_key_string in services:
+        return services[sa_key_string]
     try:
-        creds_info = json.loads(sa_key_string)
-        creds = service_account.Credentials.from_service_account_info(creds_info)
-        service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+        from googleapiclient.discovery import build_from_document
+        creds = _service_account_credentials(sa_key_string)
+        service = build_from_document(_drive_discovery_document(), credentials=creds)
+        services[sa_key_string] = service
         print("Servizio Google Drive autenticato con successo.")
         return service
     except Exception as e:
@@ -34,31 +57,67 @@ def find_id(service, name: str, parent_id: str = None, mime_type: str = None) ->
         print(f"Errore durante la ricerca di '{name}': {e}")
         return None
 
-def upload_or_update_parquet(service, df: pd.DataFrame, file_name: str, parent_folder_id: str) -> None:
-    file_metadata = {'name': file_name, 'parents': [parent_folder_id]}
+def list_files_in_folder(service, folder_id: str, name_contains: str = None) -> Dict[str, dict]:
+    """Elenca (con paginazione) i file di una cartella: {nome: {'id', 'md5Checksum', 'modifiedTime'}}."""
+    query = f"'{folder_id}' in parents and trashed = false and mimeType != 'application/vnd.google-apps.folder'"
+    if name_contains: query += f" and name contains '{name_contains}'"
+    
+    files = {}
+    page_token = None
+    while True:
+        response = service.files().list(
+            q=query, spaces='drive', pageSize=1000, pageToken=page_token,
+            fields='nextPageToken, files(id, name, md5Checksum, modifiedTime)'
+        ).execute()
+        for file in response.get('files', []):
+            files[file.get('name')] = file
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return files
+
+def dataframe_to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    """Serializza un DataFrame in Parquet (l'indice temporale diventa la colonna 'date')."""
     buffer = io.BytesIO()
     df_to_save = df.reset_index() if isinstance(df.index, pd.DatetimeIndex) else df
     df_to_save.to_parquet(buffer, index=False)
-    buffer.seek(0)
-    media = MediaIoBaseUpload(buffer, mimetype='application/octet-stream', resumable=True)
+    return buffer.getvalue()
+
+def upload_or_update_bytes(service, data: bytes, file_name: str, parent_folder_id: str,
+                           existing_file_id: Optional[str] = None, check_existing: bool = True) -> dict:
+    """
+    Carica su Drive un file Parquet già serializzato, aggiornandolo se esiste.
+    Con check_existing=False si usa direttamente `existing_file_id` (es. da list_files_in_folder)
+    risparmiando una chiamata di ricerca per file.
+    """
+    from googleapiclient.http import MediaIoBaseUpload
+    file_metadata = {'name': file_name, 'parents': [parent_folder_id]}
+    media = MediaIoBaseUpload(io.BytesIO(data), mimetype='application/octet-stream', resumable=True)
     
-    existing_file_id = find_id(service, name=file_name, parent_id=parent_folder_id)
+    if check_existing and existing_file_id is None:
+        existing_file_id = find_id(service, name=file_name, parent_id=parent_folder_id)
     
     try:
         if existing_file_id:
-            request = service.files().update(fileId=existing_file_id, media_body=media)
+            request = service.files().update(fileId=existing_file_id, media_body=media, fields='id, md5Checksum')
             print(f"  - Aggiornamento file: {file_name}...")
         else:
-            request = service.files().create(body=file_metadata, media_body=media, fields='id')
+            request = service.files().create(body=file_metadata, media_body=media, fields='id, md5Checksum')
             print(f"  - Creazione file: {file_name}...")
         
-        request.execute()
+        response = request.execute()
         print(f"  - CONFERMATO: '{file_name}' gestito con successo.")
+        return response
     except Exception as e:
         print(f"!!! FALLIMENTO upload/update per '{file_name}'. Errore: {e}")
         raise
 
-def download_parquet(service, file_id: str) -> Optional[pd.DataFrame]:
+def upload_or_update_parquet(service, df: pd.DataFrame, file_name: str, parent_folder_id: str) -> dict:
+    return upload_or_update_bytes(service, dataframe_to_parquet_bytes(df), file_name, parent_folder_id)
+
+def download_bytes(service, file_id: str) -> Optional[bytes]:
+    """Scarica il contenuto grezzo di un file. None in caso di errore HTTP."""
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaIoBaseDownload
     try:
         request = service.files().get_media(fileId=file_id)
         file_buffer = io.BytesIO()
@@ -66,41 +125,40 @@ def download_parquet(service, file_id: str) -> Optional[pd.DataFrame]:
         done = False
         while not done:
             status, done = downloader.next_chunk()
-        file_buffer.seek(0)
-        return pd.read_parquet(file_buffer)
+        return file_buffer.getvalue()
     except HttpError as e:
         print(f"Errore download file ID '{file_id}': {e}")
         return None
 
-def download_all_parquets_in_folder(service, folder_id: str) -> Dict[str, pd.DataFrame]:
+def download_parquet(service, file_id: str) -> Optional[pd.DataFrame]:
+    data = download_bytes(service, file_id)
+    return pd.read_parquet(io.BytesIO(data)) if data is not None else None
+
+def iter_parquets_in_folder(service, folder_id: str) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Scarica i file .parquet della cartella uno alla volta, restituendo (ticker, DataFrame pulito).
+    In memoria c'è un solo file per volta: il chiamante decide cosa conservare.
+    I byte Parquet sono letti in Arrow e puliti (NaN, ordinamento, deduplica) senza passare da pandas.
+    """
+    # pyarrow serve solo a chi scarica lo storico completo: non pesa sull'import della dashboard
+    from src.normalization import normalize_parquet_bytes, to_history_frame
     print(f"Ricerca file .parquet nella cartella con ID: {folder_id}...")
-    query = f"'{folder_id}' in parents and mimeType != 'application/vnd.google-apps.folder' and name contains '.parquet'"
+    files = list_files_in_folder(service, folder_id, name_contains='.parquet')
+    if not files:
+        raise FileNotFoundError("Nessun file .parquet trovato. Eseguire prima il 'full_refresh'.")
     
-    try:
-        request = service.files().list(q=query, spaces='drive', fields='files(id, name)')
-        response = request.execute()
-        files = response.get('files', [])
-        
-        if not files:
-            raise FileNotFoundError("Nessun file .parquet trovato. Eseguire prima il 'full_refresh'.")
+    print(f"Trovati {len(files)} file. Inizio download...")
+    for name, file in sorted(files.items()):
+        data = download_bytes(service, file.get('id'))
+        if data is None:
+            continue
+        table = normalize_parquet_bytes(data)
+        if table.num_rows:
+            yield name.replace('.parquet', ''), to_history_frame(table)
 
-        data_dict = {}
-        total_files = len(files)
-        print(f"Trovati {total_files} file. Inizio download...")
-        for i, file in enumerate(files):
-            df = download_parquet(service, file.get('id'))
-            if df is not None and not df.empty:
-                df.dropna(subset=['date', 'close', 'volume'], inplace=True)
-                df.drop_duplicates(subset=['date'], keep='last', inplace=True)
-                # ...
-                df['date'] = pd.to_datetime(df['date'])
-                df.set_index('date', inplace=True)
-                # PATCH: Assicura che l'indice sia unico dopo averlo impostato.
-                df = df[~df.index.duplicated(keep='last')]
-                df.sort_index(inplace=True)
-# ...
-                ticker = file.get('name').replace('.parquet', '')
-                data_dict[ticker] = df
+def download_all_parquets_in_folder(service, folder_id: str) -> Dict[str, pd.DataFrame]:
+    try:
+        data_dict = dict(iter_parquets_in_folder(service, folder_id))
         
         if not data_dict:
              raise ValueError("Nessun dato valido è stato scaricato.")
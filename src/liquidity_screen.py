@@ -0,0 +1,121 @@
+# src/liquidity_screen.py
+
+import pandas as pd
+import requests
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from src.data_processing import BTC_TICKER
+
+LIQUIDITY_SUMMARY_FILE_NAME = "liquidity_summary.parquet"
+LIQUIDITY_SUMMARY_COLUMNS = ['rebalance_date', 'lookback_days', 'rank', 'ticker', 'volume']
+
+class LiquidityScreenError(Exception):
+    """Lo screening non è affidabile (es. snapshot mancanti): il chiamante deve scaricare l'intero universo."""
+
+def fetch_bulk_eod_snapshot(api_key: str, exchange_code: str, date: pd.Timestamp) -> pd.DataFrame:
+    """
+    Scarica in una sola chiamata la barra giornaliera di tutti i ticker dell'exchange per una data.
+    Ritorna un DataFrame indicizzato per ticker con colonne close (adjusted_close se presente) e volume.
+    """
+    url = f"https://eodhd.com/api/eod-bulk-last-day/{exchange_code}?api_token={api_key}&fmt=json&date={date.strftime('%Y-%m-%d')}"
+    try:
+        r = requests.get(url, timeout=120)
+        r.raise_for_status()
+        data = r.json()
+    except requests.exceptions.RequestException as e:
+        raise LiquidityScreenError(f"Snapshot del {date.date()} non disponibile: {e}") from e
+
+    rows = {}
+    for item in data or []:
+        code = item.get("code")
+        if not code:
+            continue
+        close = item.get("adjusted_close")
+        rows[f"{code}.{exchange_code}"] = (close if close is not None else item.get("close"), item.get("volume"))
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['close', 'volume'], dtype='float64')
+
+def fetch_bulk_volume_snapshot(api_key: str, exchange_code: str, date: pd.Timestamp) -> pd.Series:
+    """Scarica in una sola chiamata il volume di tutti i ticker dell'exchange per una data."""
+    return fetch_bulk_eod_snapshot(api_key, exchange_code, date)['volume'].dropna()
+
+def _lookback_dates(rebalance_date: pd.Timestamp, lookback_days: int) -> pd.DatetimeIndex:
+    """Stessa finestra usata da create_dynamic_baskets: [rebalance - 1 - lookback_days, rebalance - 1]."""
+    lookback_end = rebalance_date - timedelta(days=1)
+    return pd.date_range(lookback_end - timedelta(days=lookback_days), lookback_end, freq='D')
+
+def update_liquidity_summary(api_key: str, exchange_code: str, rebalance_dates: pd.DatetimeIndex, lookback_days: int,
+                             volume_summary: Optional[pd.DataFrame] = None, keep: int = 200) -> pd.DataFrame:
+    """
+    Aggiorna il riepilogo dei volumi per ribilanciamento: per ogni data di ribilanciamento mancante
+    somma gli snapshot giornalieri della finestra di lookback e conserva i primi `keep` ticker.
+    I ribilanciamenti già presenti non vengono ricalcolati (i volumi passati non cambiano).
+    """
+    if volume_summary is None or volume_summary.empty:
+        volume_summary = pd.DataFrame(columns=LIQUIDITY_SUMMARY_COLUMNS)
+    else:
+        volume_summary = volume_summary.assign(rebalance_date=pd.to_datetime(volume_summary['rebalance_date']))
+
+    done = set(volume_summary.loc[volume_summary['lookback_days'] == lookback_days, 'rebalance_date'])
+    missing = [date for date in rebalance_dates if date not in done]
+    print(f"Screening liquidità: {len(rebalance_dates) - len(missing)} ribilanciamenti dal riepilogo, {len(missing)} da calcolare.")
+
+    snapshots: Dict[pd.Timestamp, pd.Series] = {}
+    new_frames = []
+    for rebalance_date in missing:
+        window_volumes = []
+        for date in _lookback_dates(rebalance_date, lookback_days):
+            if date not in snapshots:
+                snapshots[date] = fetch_bulk_volume_snapshot(api_key, exchange_code, date)
+            window_volumes.append(snapshots[date])
+        totals = pd.concat(window_volumes).groupby(level=0).sum().nlargest(keep)
+        new_frames.append(pd.DataFrame({
+            'rebalance_date': rebalance_date,
+            'lookback_days': lookback_days,
+            'rank': range(len(totals)),
+            'ticker': totals.index,
+            'volume': totals.values,
+        }))
+
+    if not new_frames:
+        return volume_summary
+    return pd.concat([volume_summary] + new_frames, ignore_index=True)
+
+def screen_liquid_candidates(universe: List[str], volume_summary: pd.DataFrame, rebalance_dates: pd.DatetimeIndex,
+                             top_n: int, lookback_days: int, margin: int = 10) -> Tuple[List[str], Dict[str, str]]:
+    """
+    Individua i ticker che possono entrare in un paniere top_n: quelli che, ad almeno un ribilanciamento,
+    sono tra i primi `top_n + margin` per volume. Il margine assorbe piccole differenze tra gli
+    snapshot bulk e lo storico per-ticker. BTC è sempre incluso.
+    Ritorna (candidati, {ticker_scartato: motivo}).
+    """
+    limit = top_n + margin
+    relevant = volume_summary[(volume_summary['lookback_days'] == lookback_days)
+                              & volume_summary['rebalance_date'].isin(rebalance_dates)]
+    if relevant['rebalance_date'].nunique() < len(rebalance_dates):
+        raise LiquidityScreenError("Riepilogo volumi incompleto per le date di ribilanciamento richieste.")
+
+    universe_set = set(universe)
+    relevant = relevant[relevant['ticker'].isin(universe_set)]
+    # Rank all'interno dell'universo corrente (ticker fuori universo non occupano posizioni)
+    relevant = relevant.assign(universe_rank=relevant.groupby('rebalance_date')['volume'].rank(method='first', ascending=False) - 1)
+    best = relevant.sort_values('universe_rank').drop_duplicates('ticker').set_index('ticker')
+
+    candidates = set(best.index[best['universe_rank'] < limit]) | {BTC_TICKER}
+    skipped = {}
+    for ticker in universe:
+        if ticker in candidates:
+            continue
+        if ticker in best.index:
+            row = best.loc[ticker]
+            skipped[ticker] = (f"rank migliore {int(row['universe_rank']) + 1} al ribilanciamento "
+                               f"{row['rebalance_date'].strftime('%Y-%m-%d')} (soglia top-{limit})")
+        else:
+            skipped[ticker] = "mai tra i ticker più liquidi in nessuna finestra di lookback"
+    return sorted(candidates & universe_set | {BTC_TICKER}), skipped
+
+def log_skipped(skipped: Dict[str, str]) -> None:
+    """Stampa i ticker esclusi dallo screening con il relativo motivo."""
+    print(f"Screening liquidità: {len(skipped)} ticker esclusi dal download completo.")
+    for ticker, reason in sorted(skipped.items()):
+        print(f"  - SKIP {ticker}: {reason}")
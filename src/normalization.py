@@ -0,0 +1,152 @@
+# src/normalization.py
+
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+import pyarrow.parquet as pq
+from typing import Union
+
+# Schema unico delle barre giornaliere, per i dati scaricati dall'API e per i file su Drive
+BAR_SCHEMA = pa.schema([
+    ('date', pa.date32()),
+    ('close', pa.float32()),
+    ('volume', pa.float64()),
+])
+
+# Colonne lette dalla risposta JSON di EODHD (le altre, es. open/high/low, vengono ignorate)
+_EOD_JSON_SCHEMA = pa.schema([
+    ('date', pa.string()),
+    ('close', pa.float64()),
+    ('adjusted_close', pa.float64()),
+    ('volume', pa.float64()),
+])
+_RECORD_SEPARATOR = re.compile(rb'\}\s*,\s*\{')
+_ARRAY_START = re.compile(rb'\s*\[')
+_EMPTY_ARRAY = re.compile(rb'\s*\[\s*\]\s*')
+
+def _to_date32(dates: pa.Array) -> pa.Array:
+    """Converte date testuali ('YYYY-MM-DD' o con orario) o timestamp in date32."""
+    if pa.types.is_date32(dates.type):
+        return dates
+    if pa.types.is_string(dates.type) or pa.types.is_large_string(dates.type):
+        # Il parsing ISO è delegato a numpy (datetime64[D]): il cast stringa->data di Arrow
+        # va occasionalmente in crash in un thread nativo con pyarrow 26
+        days = pc.utf8_slice_codeunits(dates, 0, 10)
+        if days.null_count == 0 and len(days) and pc.min_max(pc.binary_length(days)).as_py() == {'min': 10, 'max': 10}:
+            # Caso comune 'YYYY-MM-DD': il buffer a larghezza fissa è letto da numpy senza creare stringhe Python
+            fixed = days.cast(pa.binary(10))
+            raw = np.frombuffer(fixed.buffers()[1], dtype='S10', count=len(fixed), offset=fixed.offset * 10)
+            return pa.array(raw.astype('datetime64[D]'), type=pa.date32())
+        return pa.array(days.to_numpy(zero_copy_only=False).astype('datetime64[D]'), type=pa.date32(), from_pandas=True)
+    if pa.types.is_timestamp(dates.type) and dates.type.tz is not None:
+        dates = dates.cast(pa.timestamp(dates.type.unit))
+    return dates.cast(pa.date32())
+
+def _finalize(dates: pa.Array, closes: pa.Array, volumes: pa.Array) -> pa.Table:
+    """
+    Filtro NaN/null, ordinamento per data e deduplica (mantiene l'ultima barra per data) in un solo passaggio:
+    una maschera di validità, un sort stabile e una maschera di unicità sugli indici ordinati.
+    """
+    dates = _to_date32(dates)
+    closes = closes.cast(pa.float64())
+    volumes = volumes.cast(pa.float64())
+    valid = pc.and_(pc.and_(pc.is_valid(dates), pc.invert(pc.is_nan(closes.fill_null(np.nan)))),
+                    pc.invert(pc.is_nan(volumes.fill_null(np.nan))))
+    positions = np.flatnonzero(valid.to_numpy(zero_copy_only=False))
+
+    day_numbers = dates.cast(pa.int32()).to_numpy(zero_copy_only=False)[positions]
+    sort_order = np.argsort(day_numbers, kind='stable')
+    sorted_days = day_numbers[sort_order]
+    # Dopo il sort stabile l'ultima occorrenza di ogni data è quella più recente nell'input
+    keep = positions[sort_order][np.append(sorted_days[1:] != sorted_days[:-1], True)] if len(positions) else positions
+
+    take = pa.array(keep, type=pa.int64())
+    return pa.Table.from_arrays([
+        dates.take(take),
+        closes.take(take).cast(pa.float32()),
+        volumes.take(take),
+    ], schema=BAR_SCHEMA)
+
+def _eod_records_to_ndjson(payload: bytes) -> pa.Buffer:
+    """
+    L'endpoint /eod restituisce un array di record piatti: separando i record con un a capo si ottiene
+    NDJSON, leggibile direttamente dal parser JSON di Arrow. Una sola copia del payload (la sostituzione);
+    le parentesi dell'array sono escluse con una slice senza copia.
+    """
+    # La risposta dell'API è compatta ('},{'); la regex serve solo per JSON con spazi tra i record
+    body = payload.replace(b'},{', b'}\n{')
+    if _RECORD_SEPARATOR.search(body):
+        body = _RECORD_SEPARATOR.sub(b'}\n{', body)
+    start, end = body.index(b'[') + 1, body.rindex(b']')
+    return pa.py_buffer(body)[start:end]
+
+def normalize_eod_json(payload: Union[bytes, str]) -> pa.Table:
+    """
+    Converte la risposta JSON dell'endpoint EODHD /eod in una tabella BAR_SCHEMA, senza creare
+    oggetti Python per i singoli record.
+    Come in precedenza il close è adjusted_close se presente (e non tutto nullo), altrimenti close.
+    Solleva ValueError se la risposta non è un array di record o se mancano le colonne necessarie.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if not _ARRAY_START.match(payload) or payload.rfind(b']') < 0:
+        raise ValueError("la risposta non è un array di record")
+    if _EMPTY_ARRAY.fullmatch(payload):
+        return BAR_SCHEMA.empty_table()
+    body = _eod_records_to_ndjson(payload)
+
+    # Le date restano stringhe qui: la conversione avviene in _finalize
+    table = pj.read_json(pa.BufferReader(body),
+                         read_options=pj.ReadOptions(use_threads=False, block_size=max(body.size, 1 << 20)),
+                         parse_options=pj.ParseOptions(explicit_schema=_EOD_JSON_SCHEMA,
+                                                       unexpected_field_behavior='ignore'))
+
+    def _column(name):
+        column = table.column(name).combine_chunks()
+        return column if column.null_count < len(column) else None
+
+    dates, closes, adjusted, volumes = (_column(name) for name in ('date', 'close', 'adjusted_close', 'volume'))
+    if dates is None:
+        raise ValueError("i dati non contengono la colonna 'date'")
+    if adjusted is None and closes is None:
+        raise ValueError("i dati non contengono una colonna 'close' valida")
+    if volumes is None:
+        raise ValueError("i dati non contengono la colonna 'volume'")
+
+    return _finalize(dates, adjusted if adjusted is not None else closes, volumes)
+
+def normalize_parquet_bytes(data: bytes) -> pa.Table:
+    """Legge un file Parquet di storico (colonne date, close, volume) direttamente in una tabella BAR_SCHEMA."""
+    table = pq.read_table(pa.BufferReader(data), columns=['date', 'close', 'volume'])
+    return _finalize(table.column('date').combine_chunks(),
+                     table.column('close').combine_chunks(),
+                     table.column('volume').combine_chunks())
+
+def normalize_bar_frame(df: pd.DataFrame) -> pa.Table:
+    """Porta un DataFrame con colonne date, close, volume (es. l'output dei fetch) in una tabella BAR_SCHEMA."""
+    return _finalize(pa.array(df['date'].to_numpy()), pa.array(df['close'].to_numpy()), pa.array(df['volume'].to_numpy()))
+
+def concat_bars(*tables: pa.Table) -> pa.Table:
+    """Unisce più tabelle BAR_SCHEMA; a parità di data vince la barra della tabella successiva (es. il delta appena scaricato)."""
+    combined = pa.concat_tables(tables)
+    return _finalize(*(combined.column(name).combine_chunks() for name in ('date', 'close', 'volume')))
+
+def to_bar_frame(table: pa.Table) -> pd.DataFrame:
+    """DataFrame con colonne date (datetime64), close (float32), volume (float64), come restituito dai fetch."""
+    return pd.DataFrame({
+        'date': table.column('date').to_numpy().astype('datetime64[ns]'),
+        'close': table.column('close').to_numpy(),
+        'volume': table.column('volume').to_numpy(),
+    })
+
+def to_history_frame(table: pa.Table) -> pd.DataFrame:
+    """DataFrame indicizzato per data (close, volume), come usato da data_processing. Le colonne numeriche
+    non hanno null dopo la normalizzazione, quindi vengono esposte senza copie."""
+    index = pd.DatetimeIndex(table.column('date').to_numpy().astype('datetime64[ns]'), name='date')
+    return pd.DataFrame({
+        'close': table.column('close').to_numpy(),
+        'volume': table.column('volume').to_numpy(),
+    }, index=index, copy=False)
@@ -0,0 +1,133 @@
+# src/pipeline.py
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+class Stage(NamedTuple):
+    """
+    Uno stadio della pipeline.
+    Campi:
+        name: Nome dello stadio (usato nelle metriche)
+        func: Funzione applicata ad ogni elemento; se ritorna None l'elemento esce dalla pipeline
+        workers: Numero di thread dedicati allo stadio
+    """
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+class PipelineResult(NamedTuple):
+    """Esito di un elemento: `key` è l'elemento in ingresso, `stage` l'ultimo stadio raggiunto."""
+    key: Any
+    value: Any
+    stage: str
+    error: Optional[BaseException]
+
+class StageMetrics:
+    """Metriche di uno stadio: elementi processati, errori, tempo occupato e tempo di attesa sulle code."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float, blocked: float, error: bool) -> None:
+        with self._lock:
+            self.items += 1
+            self.errors += int(error)
+            self.busy_seconds += busy
+            self.blocked_seconds += blocked
+
+    def report(self, wall_seconds: float) -> str:
+        throughput = self.items / wall_seconds if wall_seconds > 0 else 0.0
+        utilization = self.busy_seconds / (wall_seconds * self.workers) if wall_seconds > 0 else 0.0
+        return (f"  - {self.name:<10} workers={self.workers:<3} items={self.items:<6} errori={self.errors:<4} "
+                f"throughput={throughput:6.2f}/s  utilizzo={utilization:6.1%}  "
+                f"busy={self.busy_seconds:8.1f}s  bloccato su coda piena={self.blocked_seconds:7.1f}s")
+
+_DONE = object()
+
+def run_pipeline(items: Iterable[Any], stages: List[Stage], queue_size: int = 8,
+                 metrics: Optional[List[StageMetrics]] = None) -> Iterator[PipelineResult]:
+    """
+    Esegue gli stadi in parallelo, collegati da code limitate (`queue_size`) per avere backpressure:
+    uno stadio veloce si blocca quando lo stadio successivo non tiene il passo, invece di accumulare
+    dati in memoria. Il tempo totale tende così a quello dello stadio più lento invece che alla somma.
+    I risultati vengono restituiti sul thread chiamante, nell'ordine di completamento.
+    Se `metrics` è una lista vuota, viene riempita con le StageMetrics di ogni stadio.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    results: queue.Queue = queue.Queue()
+    stage_metrics = [StageMetrics(stage.name, stage.workers) for stage in stages]
+    if metrics is not None:
+        metrics.extend(stage_metrics)
+
+    def feeder() -> None:
+        for item in items:
+            queues[0].put((item, item))
+        for _ in range(stages[0].workers):
+            queues[0].put(_DONE)
+
+    remaining_workers = [stage.workers for stage in stages]
+    remaining_lock = threading.Lock()
+
+    def worker(index: int) -> None:
+        stage = stages[index]
+        inbox = queues[index]
+        is_last = index == len(stages) - 1
+        while True:
+            envelope = inbox.get()
+            if envelope is _DONE:
+                break
+            key, payload = envelope
+            error, value, started = None, None, time.perf_counter()
+            try:
+                value = stage.func(payload)
+            except Exception as e:
+                error = e
+            busy = time.perf_counter() - started
+
+            blocked_start = time.perf_counter()
+            if error is not None or value is None or is_last:
+                results.put(PipelineResult(key, value, stage.name, error))
+            else:
+                queues[index + 1].put((key, value))
+            stage_metrics[index].add(busy, time.perf_counter() - blocked_start, error is not None)
+
+        # L'ultimo worker di uno stadio propaga la chiusura allo stadio successivo
+        with remaining_lock:
+            remaining_workers[index] -= 1
+            last_worker = remaining_workers[index] == 0
+        if last_worker:
+            if is_last:
+                results.put(_DONE)
+            else:
+                for _ in range(stages[index + 1].workers):
+                    queues[index + 1].put(_DONE)
+
+    threads = [threading.Thread(target=feeder, name="pipeline-feeder", daemon=True)]
+    for index, stage in enumerate(stages):
+        threads += [threading.Thread(target=worker, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True)
+                    for n in range(stage.workers)]
+    for thread in threads:
+        thread.start()
+
+    while True:
+        result = results.get()
+        if result is _DONE:
+            break
+        yield result
+
+    for thread in threads:
+        thread.join()
+
+def print_metrics(metrics: List[StageMetrics], wall_seconds: float) -> None:
+    """Stampa il riepilogo per stadio: lo stadio con utilizzo più alto è il collo di bottiglia."""
+    print(f"Metriche pipeline (tempo totale {wall_seconds:.1f}s):")
+    for stage_metrics in metrics:
+        print(stage_metrics.report(wall_seconds))
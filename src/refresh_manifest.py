@@ -0,0 +1,158 @@
+# src/refresh_manifest.py
+
+import os
+import hashlib
+import pandas as pd
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from src.gdrive_service import find_id, download_parquet, upload_or_update_parquet
+
+MANIFEST_COLUMNS = ['ticker', 'status', 'rows', 'last_date', 'checksum', 'updated_at', 'run_id']
+REFRESH_PLAN_FILE_NAME = "full_refresh_plan.parquet"
+REFRESH_PLAN_COLUMNS = ['ticker', 'candidate', 'run_id']
+
+# Stati dei ticker: al resume vengono saltati solo quelli STATUS_COMPLETE
+STATUS_COMPLETE = 'complete'
+STATUS_NO_DATA = 'no_data'
+STATUS_FAILED = 'failed'
+
+def ticker_shard(ticker: str, num_shards: int) -> int:
+    """Shard a cui appartiene un ticker: hash stabile del nome, indipendente dal resto della lista."""
+    return int(hashlib.md5(ticker.encode('utf-8')).hexdigest()[:8], 16) % num_shards
+
+def shard_tickers(tickers: List[str], shard_index: int, num_shards: int) -> List[str]:
+    """
+    Restituisce la fetta `shard_index` di `num_shards` fette disgiunte della lista ticker (ordinata).
+    L'appartenenza dipende solo dal nome del ticker: uno shard rieseguito o partito in ritardo ottiene
+    gli stessi ticker anche se nel frattempo la lista (es. i delistati del manifest) è cambiata.
+    """
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(f"Shard non valido: indice {shard_index} su {num_shards} shard.")
+    return [ticker for ticker in sorted(tickers) if ticker_shard(ticker, num_shards) == shard_index]
+
+class RefreshPlan(NamedTuple):
+    """
+    Universo di un run del refresh, calcolato una sola volta e condiviso da tutti gli shard.
+    Campi:
+        live_tickers: Ticker quotati sull'exchange all'avvio del run
+        candidates: Ticker da scaricare per intero (esito dello screening di liquidità, o tutto l'universo)
+    """
+    live_tickers: List[str]
+    candidates: List[str]
+
+def save_refresh_plan(service, folder_id: str, run_id: str, plan: RefreshPlan) -> None:
+    candidates = set(plan.candidates)
+    df = pd.DataFrame({'ticker': plan.live_tickers,
+                       'candidate': [ticker in candidates for ticker in plan.live_tickers],
+                       'run_id': run_id}, columns=REFRESH_PLAN_COLUMNS)
+    upload_or_update_parquet(service, df, REFRESH_PLAN_FILE_NAME, folder_id)
+
+def load_refresh_plan(service, folder_id: str, run_id: str) -> Optional[RefreshPlan]:
+    """Piano salvato per `run_id`; None se manca o appartiene a un altro run."""
+    file_id = find_id(service, name=REFRESH_PLAN_FILE_NAME, parent_id=folder_id)
+    df = download_parquet(service, file_id) if file_id else None
+    if df is None or df.empty or not (df['run_id'] == run_id).all():
+        return None
+    return RefreshPlan(sorted(df['ticker']), sorted(df.loc[df['candidate'], 'ticker']))
+
+def manifest_file_name(shard_index: int = 0, num_shards: int = 1) -> str:
+    """Nome del file manifest: uno per shard, così job paralleli non si sovrascrivono a vicenda."""
+    if num_shards == 1:
+        return "full_refresh_manifest.parquet"
+    return f"full_refresh_manifest_{shard_index + 1}of{num_shards}.parquet"
+
+class RefreshManifest:
+    """
+    Manifest di avanzamento del refresh completo (ticker, status, rows, last_date, checksum).
+    Viene salvato periodicamente su Google Drive e, se indicata, su una cartella locale,
+    così un refresh interrotto può riprendere dal punto in cui si era fermato.
+    Ogni voce appartiene a un run (`run_id`): il resume salta solo i ticker completati dallo stesso run,
+    quindi un nuovo refresh completo riscarica sempre tutto lo storico.
+    `on_checkpoint` viene eseguito prima di ogni salvataggio, per persistere ciò che dipende dai ticker
+    registrati (es. intervalli modificati) prima che il resume li consideri completati.
+    """
+
+    def __init__(self, service, folder_id: str, file_name: str, run_id: str, local_dir: Optional[str] = None,
+                 checkpoint_every: int = 25, on_checkpoint: Optional[Callable[[], None]] = None):
+        self.service = service
+        self.folder_id = folder_id
+        self.file_name = file_name
+        self.run_id = run_id
+        self.local_path = os.path.join(local_dir, file_name) if local_dir else None
+        self.checkpoint_every = checkpoint_every
+        self.on_checkpoint = on_checkpoint
+        self.entries: Dict[str, dict] = {}
+        self._pending = 0
+
+    def load(self) -> None:
+        """Carica le voci del manifest esistente appartenenti a questo run, preferendo la copia locale se presente."""
+        df = None
+        if self.local_path and os.path.exists(self.local_path):
+            df = pd.read_parquet(self.local_path)
+            print(f"Manifest caricato da '{self.local_path}'.")
+        elif self.service is not None and self.folder_id:
+            file_id = find_id(self.service, name=self.file_name, parent_id=self.folder_id)
+            if file_id:
+                df = download_parquet(self.service, file_id)
+                print(f"Manifest '{self.file_name}' caricato da Google Drive.")
+        if df is not None and not df.empty:
+            run_ids = df['run_id'] if 'run_id' in df.columns else pd.Series(None, index=df.index)
+            current = df[run_ids == self.run_id]
+            if len(current) < len(df):
+                print(f"Manifest: {len(df) - len(current)} voci di altri run ignorate.")
+            self.entries = {row['ticker']: row for row in current.to_dict('records')}
+        print(f"Manifest: {len(self.entries)} ticker già registrati nel run '{self.run_id}'.")
+
+    def is_done(self, ticker: str, drive_files: Dict[str, dict]) -> bool:
+        """
+        True se il ticker è già stato completato e il file su Drive non è cambiato da allora
+        (stesso md5Checksum registrato al momento dell'upload).
+        """
+        entry = self.entries.get(ticker)
+        if entry is None or entry['status'] != STATUS_COMPLETE:
+            return False
+        drive_file = drive_files.get(f"{ticker}.parquet")
+        return drive_file is not None and drive_file.get('md5Checksum') == entry['checksum']
+
+    def record(self, ticker: str, status: str, rows: int = 0, last_date: Optional[str] = None, checksum: Optional[str] = None) -> None:
+        """Registra l'esito di un ticker ed esegue un checkpoint ogni `checkpoint_every` aggiornamenti."""
+        self.entries[ticker] = {
+            'ticker': ticker,
+            'status': status,
+            'rows': int(rows),
+            'last_date': last_date,
+            'checksum': checksum,
+            'updated_at': pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'run_id': self.run_id,
+        }
+        self._pending += 1
+        if self._pending >= self.checkpoint_every:
+            self.save()
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(list(self.entries.values()), columns=MANIFEST_COLUMNS)
+
+    def save(self) -> None:
+        """Scrive il manifest in locale (se configurato) e su Google Drive."""
+        if self.on_checkpoint is not None:
+            try:
+                self.on_checkpoint()
+            except Exception as e:
+                # Senza i dati collegati il manifest non viene salvato: i ticker restano da rifare al resume
+                print(f"!!! Checkpoint collegato al manifest fallito: {e}")
+                return
+        df = self.to_frame()
+        if self.local_path:
+            os.makedirs(os.path.dirname(self.local_path) or '.', exist_ok=True)
+            df.to_parquet(self.local_path, index=False)
+        if self.service is not None and self.folder_id:
+            try:
+                upload_or_update_parquet(self.service, df, self.file_name, self.folder_id)
+            except Exception as e:
+                # Un checkpoint fallito non deve interrompere il refresh: riproveremo al prossimo
+                print(f"!!! Checkpoint del manifest su Drive fallito: {e}")
+                return
+        self._pending = 0
+
+    def summary(self) -> Dict[str, int]:
+        return self.to_frame()['status'].value_counts().to_dict() if self.entries else {}
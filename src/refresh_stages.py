@@ -0,0 +1,81 @@
+# src/refresh_stages.py
+
+import hashlib
+import io
+import time
+import pandas as pd
+from typing import Callable, Dict, List, Optional
+
+from src.asi_recompute import detect_changed_range
+from src.gdrive_service import get_gdrive_service, find_id, download_bytes, dataframe_to_parquet_bytes, upload_or_update_bytes
+from src.pipeline import Stage
+
+def make_refresh_stages(fetch_func: Callable[[str], Optional[pd.DataFrame]], sa_key: str, folder_id: str,
+                        drive_files: Optional[Dict[str, dict]] = None, fetch_workers: int = 4,
+                        transform_workers: int = 2, upload_workers: int = 4, fetch_delay: float = 0.2,
+                        track_changes: bool = False) -> List[Stage]:
+    """
+    Costruisce gli stadi fetch -> transform -> upload per lo storico dei ticker.
+    - fetch: scarica lo storico (I/O di rete); None se l'API non restituisce dati
+    - transform: serializza in Parquet e calcola righe/ultima data (CPU)
+    - upload: carica i byte su Drive (I/O di rete)
+    Se `drive_files` (da list_files_in_folder) è fornito, l'upload non cerca più il file esistente.
+    Il valore finale per ticker è un dizionario con rows, last_date e md5Checksum.
+    Con `track_changes` l'upload confronta il nuovo storico con la versione su Drive (scaricata solo se
+    l'md5 è diverso) e aggiunge changed_range: intervallo (inizio, fine) modificato, None se identico.
+    """
+    def fetch(ticker: str):
+        history_df = fetch_func(ticker)
+        # Manteniamo lo stesso ritmo di richieste per worker del refresh sequenziale
+        time.sleep(fetch_delay)
+        if history_df is None or history_df.empty:
+            print(f"  - Dati non disponibili o vuoti per {ticker}. Salto.")
+            return None
+        return ticker, history_df
+
+    def transform(fetched):
+        ticker, history_df = fetched
+        serialized = {
+            'ticker': ticker,
+            'data': dataframe_to_parquet_bytes(history_df),
+            'rows': len(history_df),
+            'last_date': pd.Timestamp(history_df['date'].max()).strftime('%Y-%m-%d'),
+        }
+        if track_changes:
+            serialized['history'] = history_df
+        return serialized
+
+    def changed_range(service, serialized, existing_file_id, stored_checksum):
+        if existing_file_id and stored_checksum == hashlib.md5(serialized['data']).hexdigest():
+            return None
+        stored = download_bytes(service, existing_file_id) if existing_file_id else None
+        previous = pd.read_parquet(io.BytesIO(stored)) if stored is not None else None
+        return detect_changed_range(previous, serialized['history'])
+
+    def upload(serialized):
+        file_name = f"{serialized['ticker']}.parquet"
+        # get_gdrive_service mantiene un client per thread: ogni worker di upload riusa il proprio
+        service = get_gdrive_service(sa_key)
+        if drive_files is None:
+            existing_file_id = find_id(service, name=file_name, parent_id=folder_id) if track_changes else None
+            stored_checksum = None
+        else:
+            existing_file_id = drive_files.get(file_name, {}).get('id')
+            stored_checksum = drive_files.get(file_name, {}).get('md5Checksum')
+        # Il confronto avviene prima dell'upload, che sovrascrive la versione precedente
+        changes = changed_range(service, serialized, existing_file_id, stored_checksum) if track_changes else None
+        if drive_files is None and not track_changes:
+            response = upload_or_update_bytes(service, serialized['data'], file_name, folder_id)
+        else:
+            response = upload_or_update_bytes(service, serialized['data'], file_name, folder_id,
+                                              existing_file_id=existing_file_id, check_existing=False)
+        value = {'rows': serialized['rows'], 'last_date': serialized['last_date'], 'md5Checksum': response.get('md5Checksum')}
+        if track_changes:
+            value['changed_range'] = changes
+        return value
+
+    return [
+        Stage('fetch', fetch, fetch_workers),
+        Stage('transform', transform, transform_workers),
+        Stage('upload', upload, upload_workers),
+    ]
@@ -1,7 +1,83 @@
 # src/rule_engine.py
 
+import itertools
+import numpy as np
 import pandas as pd
-from typing import Tuple
+from typing import Dict, FrozenSet, List, NamedTuple, Tuple
+
+from src.asi_indicator_calculator import ASI_REGIME_LABELS, RSI_PHASE_LABELS, SLOPE_PHASE_LABELS
+
+# Tutte le combinazioni (asi_regime, rsi_phase, slope_phase): la posizione nella lista è il codice di fase
+# (asi * 9 + rsi * 3 + slope), usato dal backtest per indicizzare le tabelle delle regole
+PHASE_COMBINATIONS: List[Tuple[str, str, str]] = list(itertools.product(ASI_REGIME_LABELS, RSI_PHASE_LABELS, SLOPE_PHASE_LABELS))
+
+BOOST_AMOUNTS = {"Low": 5000, "Standard": 10000, "High": 15000}
+
+class RuleSet(NamedTuple):
+    """
+    Regole di boost di un Trading System.
+    Campi:
+        name: Nome del Trading System (es. 'TS1'), usato negli ID delle regole
+        high: Combinazioni (asi_regime, rsi_phase, slope_phase) con boost High
+        low: Combinazioni con boost Low; tutte le altre sono Standard
+        amounts: Importo in USD per livello di boost
+    """
+    name: str
+    high: FrozenSet[Tuple[str, str, str]]
+    low: FrozenSet[Tuple[str, str, str]]
+    amounts: Dict[str, int] = BOOST_AMOUNTS
+
+TS1_RULES = RuleSet("TS1",
+    high=frozenset({
+        ('Neutro (20-60)', 'Forte (>60)', 'ForteSal(>0.5)'),
+        ('Alto (60-100)', 'Neutro (40-60)', 'ForteDisc(<-0.5)'),
+        ('Neutro (20-60)', 'Debole (<40)', 'Lat/Mod(-0.5/0.5)'),
+        ('Neutro (20-60)', 'Debole (<40)', 'ForteDisc(<-0.5)'),
+    }),
+    low=frozenset({
+        ('Basso (0-20)', 'Debole (<40)', 'Lat/Mod(-0.5/0.5)'),
+        ('Alto (60-100)', 'Forte (>60)', 'ForteSal(>0.5)'),
+        ('Alto (60-100)', 'Neutro (40-60)', 'Lat/Mod(-0.5/0.5)'),
+        ('Basso (0-20)', 'Neutro (40-60)', 'Lat/Mod(-0.5/0.5)'),
+    }))
+
+TS2_RULES = RuleSet("TS2",
+    high=frozenset({
+        ('Neutro (20-60)', 'Forte (>60)', 'ForteSal(>0.5)'),
+        ('Basso (0-20)', 'Debole (<40)', 'ForteDisc(<-0.5)'),
+        ('Basso (0-20)', 'Neutro (40-60)', 'ForteDisc(<-0.5)'),
+        ('Neutro (20-60)', 'Neutro (40-60)', 'ForteDisc(<-0.5)'),
+    }),
+    low=frozenset({
+        ('Alto (60-100)', 'Neutro (40-60)', 'Lat/Mod(-0.5/0.5)'),
+        ('Basso (0-20)', 'Debole (<40)', 'Lat/Mod(-0.5/0.5)'),
+    }))
+
+def boost_level(rules: RuleSet, phases: Tuple[str, str, str]) -> str:
+    """Livello di boost (High, Low o Standard) di una combinazione di fasi. Le High hanno la precedenza."""
+    if phases in rules.high:
+        return "High"
+    if phases in rules.low:
+        return "Low"
+    return "Standard"
+
+def amount_table(rules: RuleSet) -> np.ndarray:
+    """Importo del boost per ciascun codice di fase (vettore di 27 valori, ordine di PHASE_COMBINATIONS)."""
+    return np.array([rules.amounts[boost_level(rules, phases)] for phases in PHASE_COMBINATIONS], dtype=np.float64)
+
+def get_boost(latest_indicators_row: pd.Series, rules: RuleSet) -> Tuple[str, str, str]:
+    """
+    Determina il livello di boost, l'importo e l'ID della regola per un Trading System.
+    Le fasi mancanti (es. nei primi giorni dello storico) ricadono nel boost Standard.
+    """
+    phases = (latest_indicators_row['asi_regime'], latest_indicators_row['rsi_phase'], latest_indicators_row['slope_phase'])
+    level = boost_level(rules, phases)
+    amount = f"{rules.amounts[level]:,} USD"
+    if level == "Standard":
+        return level, amount, f"{rules.name}-Standard-Default"
+    # Nota: L'ID regola specifico non è determinabile dal livello, ma il livello sì.
+    # Per la dashboard, mostreremo il livello e l'elenco delle possibili regole attive.
+    return level, amount, f"Regole {level} Boost {rules.name}"
 
 def get_boost_ts1(latest_indicators_row: pd.Series) -> Tuple[str, str, str]:
     """
@@ -14,34 +90,7 @@ def get_boost_ts1(latest_indicators_row: pd.Series) -> Tuple[str, str, str]:
     Returns:
         Un tupla contenente (livello_boost, importo_boost, id_regola).
     """
-    asi_regime = latest_indicators_row['asi_regime']
-    rsi_phase = latest_indicators_row['rsi_phase']
-    slope_phase = latest_indicators_row['slope_phase']
-
-    # --- Condizioni HIGH BOOST (TS1) ---
-    is_high_boost = (
-        (asi_regime == 'Neutro (20-60)' and rsi_phase == 'Forte (>60)' and slope_phase == 'ForteSal(>0.5)') or
-        (asi_regime == 'Alto (60-100)' and rsi_phase == 'Neutro (40-60)' and slope_phase == 'ForteDisc(<-0.5)') or
-        (asi_regime == 'Neutro (20-60)' and rsi_phase == 'Debole (<40)' and slope_phase == 'Lat/Mod(-0.5/0.5)') or
-        (asi_regime == 'Neutro (20-60)' and rsi_phase == 'Debole (<40)' and slope_phase == 'ForteDisc(<-0.5)')
-    )
-    if is_high_boost:
-        # Nota: L'ID regola specifico non è determinabile da questo blocco, ma il livello sì.
-        # Per la dashboard, mostreremo il livello e l'elenco delle possibili regole attive.
-        return "High", "15,000 USD", "Regole High Boost TS1"
-
-    # --- Condizioni LOW BOOST (TS1) ---
-    is_low_boost = (
-        (asi_regime == 'Basso (0-20)' and rsi_phase == 'Debole (<40)' and slope_phase == 'Lat/Mod(-0.5/0.5)') or
-        (asi_regime == 'Alto (60-100)' and rsi_phase == 'Forte (>60)' and slope_phase == 'ForteSal(>0.5)') or
-        (asi_regime == 'Alto (60-100)' and rsi_phase == 'Neutro (40-60)' and slope_phase == 'Lat/Mod(-0.5/0.5)') or
-        (asi_regime == 'Basso (0-20)' and rsi_phase == 'Neutro (40-60)' and slope_phase == 'Lat/Mod(-0.5/0.5)')
-    )
-    if is_low_boost:
-        return "Low", "5,000 USD", "Regole Low Boost TS1"
-
-    # --- Condizione STANDARD BOOST (TS1) ---
-    return "Standard", "10,000 USD", "TS1-Standard-Default"
+    return get_boost(latest_indicators_row, TS1_RULES)
 
 
 def get_boost_ts2(latest_indicators_row: pd.Series) -> Tuple[str, str, str]:
@@ -55,27 +104,4 @@ def get_boost_ts2(latest_indicators_row: pd.Series) -> Tuple[str, str, str]:
     Returns:
         Un tupla contenente (livello_boost, importo_boost, id_regola).
     """
-    asi_regime = latest_indicators_row['asi_regime']
-    rsi_phase = latest_indicators_row['rsi_phase']
-    slope_phase = latest_indicators_row['slope_phase']
-
-    # --- Condizioni HIGH BOOST (TS2) ---
-    is_high_boost = (
-        (asi_regime == 'Neutro (20-60)' and rsi_phase == 'Forte (>60)' and slope_phase == 'ForteSal(>0.5)') or
-        (asi_regime == 'Basso (0-20)' and rsi_phase == 'Debole (<40)' and slope_phase == 'ForteDisc(<-0.5)') or
-        (asi_regime == 'Basso (0-20)' and rsi_phase == 'Neutro (40-60)' and slope_phase == 'ForteDisc(<-0.5)') or
-        (asi_regime == 'Neutro (20-60)' and rsi_phase == 'Neutro (40-60)' and slope_phase == 'ForteDisc(<-0.5)')
-    )
-    if is_high_boost:
-        return "High", "15,000 USD", "Regole High Boost TS2"
-
-    # --- Condizioni LOW BOOST (TS2) ---
-    is_low_boost = (
-        (asi_regime == 'Alto (60-100)' and rsi_phase == 'Neutro (40-60)' and slope_phase == 'Lat/Mod(-0.5/0.5)') or
-        (asi_regime == 'Basso (0-20)' and rsi_phase == 'Debole (<40)' and slope_phase == 'Lat/Mod(-0.5/0.5)')
-    )
-    if is_low_boost:
-        return "Low", "5,000 USD", "Regole Low Boost TS2"
-
-    # --- Condizione STANDARD BOOST (TS2) ---
-    return "Standard", "10,000 USD", "TS2-Standard-Default"
+    return get_boost(latest_indicators_row, TS2_RULES)
@@ -0,0 +1,211 @@
+# src/streaming_aggregation.py
+
+import heapq
+import logging
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.data_processing import BTC_TICKER, BASKET_HISTORY_COLUMNS, BASKET_START_DATE, rebalance_schedule
+
+logger = logging.getLogger(__name__)
+
+class _ReversedTicker(str):
+    """Ordinamento inverso dei ticker nell'heap: a parità di volume esce prima il ticker 'più grande',
+    così il paniere finale coincide con nlargest(keep='first') sui ticker ordinati."""
+
+    def __lt__(self, other):
+        return str.__gt__(self, other)
+
+    def __gt__(self, other):
+        return str.__lt__(self, other)
+
+class StreamingBasketAggregator:
+    """
+    Costruisce panieri e matrice dei close leggendo lo storico un ticker alla volta.
+    Per ogni ribilanciamento mantiene solo un heap dei top_n ticker per volume nella finestra di lookback;
+    i close vengono conservati solo per i ticker attualmente in almeno un paniere (più BTC e `keep_tickers`).
+    Quando i close conservati superano `memory_budget_mb` vengono spostati su disco e riletti solo alla fine,
+    quindi la memoria di picco non dipende dal numero di ticker dell'universo.
+    """
+
+    def __init__(self, rebalance_dates: Iterable[pd.Timestamp], top_n: int = 50, lookback_days: int = 30,
+                 rebalancing_freq: str = '90D', memory_budget_mb: float = 256, keep_tickers: Iterable[str] = (),
+                 spill_dir: Optional[str] = None):
+        self.rebalance_dates = pd.DatetimeIndex(sorted(rebalance_dates))
+        self.top_n = top_n
+        self.lookback_days = lookback_days
+        self.rebalancing_freq = rebalancing_freq
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self.keep_tickers = set(keep_tickers) | {BTC_TICKER}
+
+        # Estremi delle finestre di lookback: [rebalance - 1 - lookback_days, rebalance - 1]
+        lookback_end = self.rebalance_dates - timedelta(days=1)
+        self._window_start = (lookback_end - timedelta(days=lookback_days)).values
+        self._window_end = lookback_end.values
+
+        self._heaps: List[list] = [[] for _ in self.rebalance_dates]
+        self._basket_refs: Dict[str, int] = {}
+        self._closes_in_memory: Dict[str, pd.Series] = {}
+        self._closes_on_disk: Dict[str, str] = {}
+        self._bytes_in_memory = 0
+        self._spilled_files = 0
+        self._spill_dir_owner = None if spill_dir else tempfile.TemporaryDirectory(prefix='asi_spill_')
+        self._spill_dir = spill_dir or self._spill_dir_owner.name
+        self.first_date: Optional[pd.Timestamp] = None
+        self.last_date: Optional[pd.Timestamp] = None
+        self.tickers_seen = 0
+        self.peak_bytes_in_memory = 0
+
+    def add(self, ticker: str, df: pd.DataFrame) -> None:
+        """Aggiorna gli aggregati con lo storico (indice temporale ordinato, colonne close e volume) di un ticker."""
+        self.tickers_seen += 1
+        if df.empty:
+            return
+        self.first_date = df.index[0] if self.first_date is None else min(self.first_date, df.index[0])
+        self.last_date = df.index[-1] if self.last_date is None else max(self.last_date, df.index[-1])
+
+        # Somme di volume per tutte le finestre in un colpo solo (somme cumulative + searchsorted)
+        dates = df.index.values
+        cumulative_volume = np.concatenate(([0.0], np.cumsum(np.nan_to_num(df['volume'].to_numpy(dtype=np.float64)))))
+        starts = np.searchsorted(dates, self._window_start, side='left')
+        ends = np.searchsorted(dates, self._window_end, side='right')
+        volumes = cumulative_volume[ends] - cumulative_volume[starts]
+
+        for i in np.flatnonzero(ends > starts):
+            self._push(i, float(volumes[i]), ticker)
+
+        if ticker in self.keep_tickers or self._basket_refs.get(ticker, 0) > 0:
+            self._keep_closes(ticker, df['close'])
+
+    def _push(self, i: int, volume: float, ticker: str) -> None:
+        heap = self._heaps[i]
+        entry = (volume, _ReversedTicker(ticker))
+        if len(heap) < self.top_n:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            _, evicted = heapq.heapreplace(heap, entry)
+            self._release(str(evicted))
+        else:
+            return
+        self._basket_refs[ticker] = self._basket_refs.get(ticker, 0) + 1
+
+    def _release(self, ticker: str) -> None:
+        """Un ticker uscito da tutti i panieri non serve più: i suoi close vengono scartati."""
+        self._basket_refs[ticker] -= 1
+        if self._basket_refs[ticker] > 0 or ticker in self.keep_tickers:
+            return
+        del self._basket_refs[ticker]
+        series = self._closes_in_memory.pop(ticker, None)
+        if series is not None:
+            self._bytes_in_memory -= series.memory_usage(index=True, deep=False)
+        path = self._closes_on_disk.pop(ticker, None)
+        if path is not None:
+            os.remove(path)
+
+    def _keep_closes(self, ticker: str, closes: pd.Series) -> None:
+        closes = closes.astype(np.float64, copy=True)
+        self._closes_in_memory[ticker] = closes
+        self._bytes_in_memory += closes.memory_usage(index=True, deep=False)
+        self.peak_bytes_in_memory = max(self.peak_bytes_in_memory, self._bytes_in_memory)
+        while self._bytes_in_memory > self.memory_budget_bytes and self._closes_in_memory:
+            self._spill(next(iter(self._closes_in_memory)))
+
+    def _spill(self, ticker: str) -> None:
+        series = self._closes_in_memory.pop(ticker)
+        self._bytes_in_memory -= series.memory_usage(index=True, deep=False)
+        self._spilled_files += 1
+        path = os.path.join(self._spill_dir, f"closes_{self._spilled_files}.npz")
+        np.savez(path, index=series.index.values, values=series.to_numpy())
+        self._closes_on_disk[ticker] = path
+
+    def basket_history(self) -> pd.DataFrame:
+        """Storico panieri nel formato di extend_basket_history (solo ribilanciamenti con dati nella finestra)."""
+        rows = []
+        for rebalance_date, heap in zip(self.rebalance_dates, self._heaps):
+            if not heap or (self.last_date is not None and rebalance_date > self.last_date):
+                continue
+            ranked = sorted(heap, key=lambda entry: (-entry[0], str(entry[1])))
+            for rank, (_, ticker) in enumerate(ranked):
+                rows.append((rebalance_date, rank, str(ticker), self.top_n, self.lookback_days, self.rebalancing_freq))
+        return pd.DataFrame(rows, columns=BASKET_HISTORY_COLUMNS)
+
+    def closes(self) -> pd.DataFrame:
+        """Matrice dei close (date x ticker) dei soli candidati, ricaricando quelli spostati su disco."""
+        columns = dict(self._closes_in_memory)
+        for ticker, path in self._closes_on_disk.items():
+            with np.load(path) as stored:
+                columns[ticker] = pd.Series(stored['values'], index=pd.DatetimeIndex(stored['index']))
+        return pd.DataFrame(columns).sort_index()
+
+    def close(self) -> None:
+        if self._spill_dir_owner is not None:
+            self._spill_dir_owner.cleanup()
+
+def stream_historical_data(frames: Iterator[Tuple[str, pd.DataFrame]], rebalance_dates: Iterable[pd.Timestamp],
+                           top_n: int = 50, lookback_days: int = 30, rebalancing_freq: str = '90D',
+                           memory_budget_mb: float = 256, keep_tickers: Iterable[str] = ()) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Consuma un iteratore (ticker, DataFrame) — es. iter_parquets_in_folder — senza mai tenere in memoria
+    l'intero universo. Ritorna (matrice dei close dei candidati per calculate_full_asi, storico panieri).
+    """
+    aggregator = StreamingBasketAggregator(rebalance_dates, top_n, lookback_days, rebalancing_freq,
+                                           memory_budget_mb, keep_tickers)
+    try:
+        for ticker, df in frames:
+            aggregator.add(ticker, df)
+        basket_history = aggregator.basket_history()
+        closes = aggregator.closes()
+    finally:
+        aggregator.close()
+    logger.info(f"Streaming: {aggregator.tickers_seen} ticker letti, {closes.shape[1]} close conservati, "
+                f"picco in memoria {aggregator.peak_bytes_in_memory / 1024 / 1024:.1f} MB, "
+                f"{len(aggregator._closes_on_disk)} serie spostate su disco")
+    return closes, basket_history
+
+def stream_raw_history(service, folder_id: str, stored_history: Optional[pd.DataFrame] = None, memory_budget_mb: float = 256,
+                       top_n: int = 50, lookback_days: int = 30, rebalancing_freq: str = '90D') -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Modalità a memoria limitata dei job che leggono l'intera cartella raw-history: i file vengono letti uno alla
+    volta (iter_parquets_in_folder) e passati allo StreamingBasketAggregator.
+    Con lo storico panieri salvato ne riusa parametri e calendario, e conserva anche i close dei suoi ticker.
+    Ritorna (matrice dei close dei ticker dei panieri e di BTC, storico panieri calcolato in streaming).
+    """
+    from src.gdrive_service import iter_parquets_in_folder
+
+    keep_tickers = set()
+    anchor = BASKET_START_DATE
+    if stored_history is not None and not stored_history.empty:
+        top_n = int(stored_history['top_n'].iloc[0])
+        lookback_days = int(stored_history['lookback_days'].iloc[0])
+        rebalancing_freq = stored_history['rebalancing_freq'].iloc[0]
+        keep_tickers = set(stored_history['ticker'])
+        anchor = pd.Timestamp(stored_history['rebalance_date'].min())
+    rebalance_dates = rebalance_schedule(anchor, pd.Timestamp.today().normalize(), rebalancing_freq)
+    return stream_historical_data(iter_parquets_in_folder(service, folder_id), rebalance_dates, top_n, lookback_days,
+                                  rebalancing_freq, memory_budget_mb, keep_tickers)
+
+def combine_basket_histories(stored_history: Optional[pd.DataFrame], streamed_history: pd.DataFrame,
+                             refreshed_dates: Iterable[pd.Timestamp] = ()) -> Tuple[pd.DataFrame, List[pd.Timestamp]]:
+    """
+    Equivalente in streaming di refresh_affected_rebalances + extend_basket_history: mantiene i ribilanciamenti
+    salvati, prende dallo streaming quelli in `refreshed_dates` e quelli successivi all'ultimo salvato.
+    Ritorna (storico panieri, date di ribilanciamento il cui paniere è cambiato o è nuovo).
+    """
+    if stored_history is None or stored_history.empty:
+        return streamed_history, sorted(streamed_history['rebalance_date'].unique())
+    last_stored = stored_history['rebalance_date'].max()
+    refreshed = set(pd.DatetimeIndex(list(refreshed_dates)))
+    from_stream = streamed_history['rebalance_date'].isin(refreshed) | (streamed_history['rebalance_date'] > last_stored)
+
+    changed = []
+    stored_baskets = {date: group['ticker'].tolist() for date, group in stored_history.sort_values(['rebalance_date', 'rank']).groupby('rebalance_date')}
+    for date, group in streamed_history[from_stream].sort_values(['rebalance_date', 'rank']).groupby('rebalance_date'):
+        if stored_baskets.get(date) != group['ticker'].tolist():
+            changed.append(pd.Timestamp(date))
+    replaced = stored_history['rebalance_date'].isin(changed)
+    combined = pd.concat([stored_history[~replaced], streamed_history[streamed_history['rebalance_date'].isin(changed)]], ignore_index=True)
+    return combined.sort_values(['rebalance_date', 'rank'], ignore_index=True), changed
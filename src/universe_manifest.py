@@ -0,0 +1,163 @@
+# src/universe_manifest.py
+
+import pandas as pd
+from datetime import timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from src.gdrive_service import download_parquet, list_files_in_folder, upload_or_update_parquet
+from src.liquidity_screen import fetch_bulk_eod_snapshot
+from src.normalization import normalize_parquet_bytes, normalize_bar_frame, concat_bars, to_bar_frame
+
+UNIVERSE_MANIFEST_PREFIX = "universe_manifest"
+UNIVERSE_COLUMNS = ['ticker', 'status', 'first_seen', 'last_seen', 'rows', 'last_date', 'updated_at']
+
+# Stati dell'universo: i ticker delistati restano nel manifest ma non generano più richieste
+STATUS_LISTED = 'listed'
+STATUS_DELISTED = 'delisted'
+
+def universe_manifest_file_name(shard_index: int = 0, num_shards: int = 1) -> str:
+    """Un file per shard (come il manifest del refresh): job paralleli non si sovrascrivono a vicenda."""
+    if num_shards == 1:
+        return f"{UNIVERSE_MANIFEST_PREFIX}.parquet"
+    return f"{UNIVERSE_MANIFEST_PREFIX}_{shard_index + 1}of{num_shards}.parquet"
+
+class UniverseDiff(NamedTuple):
+    """
+    Differenza tra la lista ticker attuale dell'exchange e il manifest dell'universo.
+    Campi:
+        new: Ticker mai visti o tornati quotati dopo un delisting: storico completo
+        existing: Ticker quotati con storico salvato: aggiornamento incrementale dall'ultima data
+        dormant: Ticker quotati senza storico salvato (nessun dato o esclusi dallo screening)
+        delisted: Ticker spariti dalla lista dell'exchange: congelati, nessuna richiesta
+    """
+    new: List[str]
+    existing: List[str]
+    dormant: List[str]
+    delisted: List[str]
+
+class UniverseManifest:
+    """
+    Manifest persistente dell'universo: per ogni ticker prima/ultima volta in cui è stato visto nella lista
+    dell'exchange, righe e ultima data dello storico salvato su Drive, stato (quotato/delistato).
+    Ogni shard riscrive il proprio file con tutte le voci della sua partizione (anche quelle non toccate,
+    es. i delistati congelati); al caricamento i file vengono uniti tenendo per ogni ticker la voce
+    aggiornata più di recente.
+    """
+
+    def __init__(self, service, folder_id: str, file_name: str):
+        self.service = service
+        self.folder_id = folder_id
+        self.file_name = file_name
+        self.entries: Dict[str, dict] = {}
+        self._touched = set()
+        self._unsaved = False
+
+    def load(self) -> None:
+        files = list_files_in_folder(self.service, self.folder_id, name_contains=UNIVERSE_MANIFEST_PREFIX)
+        frames = [download_parquet(self.service, file['id']) for name, file in sorted(files.items()) if name.endswith('.parquet')]
+        frames = [df for df in frames if df is not None and not df.empty]
+        if frames:
+            merged = pd.concat(frames, ignore_index=True).sort_values('updated_at').drop_duplicates('ticker', keep='last')
+            self.entries = {row['ticker']: row for row in merged.to_dict('records')}
+        print(f"Manifest dell'universo: {len(self.entries)} ticker noti ({len(files)} file).")
+
+    def diff(self, live_tickers: Iterable[str]) -> UniverseDiff:
+        """Confronta la lista attuale con il manifest, senza modificarlo."""
+        live = set(live_tickers)
+        new, existing, dormant = [], [], []
+        for ticker in sorted(live):
+            entry = self.entries.get(ticker)
+            if entry is None or entry['status'] == STATUS_DELISTED:
+                new.append(ticker)
+            elif entry['rows'] > 0 and pd.notna(entry['last_date']):
+                existing.append(ticker)
+            else:
+                dormant.append(ticker)
+        delisted = sorted(ticker for ticker, entry in self.entries.items()
+                          if ticker not in live and entry['status'] == STATUS_LISTED)
+        return UniverseDiff(new, existing, dormant, delisted)
+
+    def _update(self, ticker: str, **fields) -> None:
+        entry = self.entries.get(ticker) or {'ticker': ticker, 'status': STATUS_LISTED, 'first_seen': fields.get('last_seen'),
+                                             'last_seen': None, 'rows': 0, 'last_date': None}
+        entry.update(fields)
+        entry['updated_at'] = pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        self.entries[ticker] = entry
+        self._touched.add(ticker)
+        self._unsaved = True
+
+    def mark_seen(self, tickers: Iterable[str], today: str) -> None:
+        """Ticker presenti nella lista dell'exchange: aggiorna last_seen (e first_seen per i nuovi)."""
+        for ticker in tickers:
+            entry = self.entries.get(ticker)
+            if entry is not None and entry['status'] == STATUS_DELISTED:
+                # Tornato quotato: lo storico salvato ha un buco, verrà riscaricato per intero
+                self._update(ticker, status=STATUS_LISTED, last_seen=today, rows=0, last_date=None)
+            else:
+                self._update(ticker, status=STATUS_LISTED, last_seen=today)
+
+    def mark_delisted(self, tickers: Iterable[str]) -> None:
+        for ticker in tickers:
+            self._update(ticker, status=STATUS_DELISTED)
+
+    def record(self, ticker: str, rows: int, last_date: str) -> None:
+        """Registra righe e ultima data dello storico appena salvato su Drive."""
+        self._update(ticker, rows=int(rows), last_date=last_date)
+
+    def to_frame(self, tickers: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        selected = self.entries if tickers is None else {t: self.entries[t] for t in tickers if t in self.entries}
+        return pd.DataFrame(list(selected.values()), columns=UNIVERSE_COLUMNS)
+
+    def save(self, owned: Optional[Iterable[str]] = None) -> None:
+        """
+        Scrive sul file di questo shard le voci della partizione `owned` più quelle toccate in questa esecuzione.
+        Senza `owned` vengono scritte solo le voci toccate. Nessuna scrittura se nulla è cambiato dall'ultimo
+        salvataggio, così può essere chiamato a ogni checkpoint.
+        """
+        if not self._unsaved:
+            return
+        tickers = self._touched if owned is None else self._touched | set(owned)
+        upload_or_update_parquet(self.service, self.to_frame(sorted(tickers)), self.file_name, self.folder_id)
+        self._unsaved = False
+
+    def summary(self) -> Dict[str, int]:
+        return self.to_frame()['status'].value_counts().to_dict() if self.entries else {}
+
+def last_complete_day() -> pd.Timestamp:
+    """Ultimo giorno UTC concluso: la barra di oggi è ancora parziale e non va mai salvata."""
+    return pd.Timestamp.now(tz='UTC').tz_localize(None).normalize() - timedelta(days=1)
+
+def clip_bars(df: pd.DataFrame, end_date: pd.Timestamp) -> pd.DataFrame:
+    """Scarta le barre successive a `end_date` (colonna date, come restituito dai fetch)."""
+    return df[df['date'] <= end_date].reset_index(drop=True)
+
+def resync_start(last_date: str, end_date: pd.Timestamp) -> pd.Timestamp:
+    """
+    Primo giorno da riscaricare per un ticker il cui storico arriva a `last_date`. L'ultima barra salvata
+    viene riscaricata anch'essa: se era parziale (salvata prima della chiusura del giorno) viene sostituita.
+    """
+    return min(pd.Timestamp(last_date), end_date)
+
+def collect_bulk_bars(api_key: str, exchange_code: str, dates: pd.DatetimeIndex, tickers: Iterable[str]) -> Dict[str, pd.DataFrame]:
+    """
+    Barre dei giorni `dates` per i ticker richiesti, con una sola chiamata bulk per giorno
+    (invece di una per ticker). Ritorna {ticker: DataFrame(date, close, volume)} per i ticker con dati.
+    """
+    wanted = set(tickers)
+    frames = []
+    for date in dates:
+        snapshot = fetch_bulk_eod_snapshot(api_key, exchange_code, date)
+        snapshot = snapshot[snapshot.index.isin(wanted)].dropna()
+        frames.append(snapshot.assign(date=date).rename_axis('ticker').reset_index())
+    if not frames:
+        return {}
+    bars = pd.concat(frames, ignore_index=True)
+    return {ticker: group[['date', 'close', 'volume']].reset_index(drop=True) for ticker, group in bars.groupby('ticker')}
+
+def append_history(stored: bytes, delta_df: pd.DataFrame, end_date: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """
+    Storico salvato (byte Parquet) più le barre nuove; a parità di data vince il delta.
+    Con `end_date` vengono scartate le barre successive (es. una barra parziale salvata in passato).
+    """
+    history = to_bar_frame(concat_bars(normalize_parquet_bytes(stored), normalize_bar_frame(delta_df)))
+    return history if end_date is None else clip_bars(history, end_date)
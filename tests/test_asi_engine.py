@@ -0,0 +1,100 @@
+# tests/test_asi_engine.py
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing import BTC_TICKER, ASIVariant, calculate_asi_variants, calculate_full_asi
+
+
+def reference_asi(historical_data, baskets, performance_window):
+    """Ciclo per data originale: pct_change con pad limitato alla finestra [date - pw, date]."""
+    rows = {}
+    for date in historical_data.index:
+        basket = baskets.get(date.strftime('%Y-%m-%d'), [])
+        if len(basket) == 0:
+            continue
+        btc_data = historical_data[BTC_TICKER].loc[date - timedelta(days=performance_window):date]
+        if len(btc_data) < performance_window or btc_data.isna().all():
+            continue
+        btc_perf = btc_data.ffill().pct_change(fill_method=None).mean()
+        outperforming = 0
+        basket_size = min(len(basket), 50)
+        for alt in basket:
+            alt_data = historical_data[alt].loc[date - timedelta(days=performance_window):date]
+            if len(alt_data) < performance_window or alt_data.isna().all():
+                continue
+            if alt_data.ffill().pct_change(fill_method=None).mean() > btc_perf:
+                outperforming += 1
+        rows[date] = (outperforming / basket_size * 100, outperforming, basket_size)
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['index_value', 'outperforming_count', 'basket_size'], dtype=float)
+
+
+def synthetic_closes(n_rows, n_alts, gap_fraction, seed=0, freq='D'):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2021-01-01', periods=n_rows, freq=freq)
+    columns = [BTC_TICKER] + [f'ALT{i}-USD.CC' for i in range(n_alts)]
+    closes = pd.DataFrame(np.exp(np.cumsum(rng.normal(0, 0.03, (n_rows, len(columns))), axis=0)),
+                          index=index, columns=columns)
+    closes = closes.mask(rng.random(closes.shape) < gap_fraction)
+    closes[BTC_TICKER] = closes[BTC_TICKER].ffill().bfill()
+    baskets = {key: columns[1:] for key in index.strftime('%Y-%m-%d')}
+    return closes, baskets
+
+
+def test_gap_at_window_start_does_not_use_prices_before_the_window():
+    index = pd.date_range('2024-01-01', periods=12, freq='D')
+    closes = pd.DataFrame({
+        BTC_TICKER: np.full(12, 100.0),
+        'ALT-USD.CC': [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, np.nan, 2.0, 2.0, 2.0],
+    }, index=index)
+    baskets = {key: ['ALT-USD.CC'] for key in index.strftime('%Y-%m-%d')}
+
+    asi = calculate_full_asi(closes, baskets, performance_window=3)
+    expected = reference_asi(closes, baskets, 3)
+    # Nell'ultima finestra il salto 1 -> 2 avviene prima dell'inizio: nessun rendimento positivo
+    assert asi['index_value'].iloc[-3:].tolist() == [100.0, 100.0, 0.0]
+    pd.testing.assert_series_equal(asi['index_value'].dropna(), expected['index_value'], check_names=False, check_freq=False)
+
+
+@pytest.mark.parametrize('performance_window', [7, 30])
+def test_matches_per_date_loop_on_data_with_gaps(performance_window):
+    closes, baskets = synthetic_closes(400, 20, gap_fraction=0.03)
+    asi = calculate_full_asi(closes, baskets, performance_window).dropna(subset=['index_value'])
+    expected = reference_asi(closes, baskets, performance_window)
+    pd.testing.assert_frame_equal(asi, expected, check_freq=False, check_names=False)
+
+
+def test_cumulative_variant_matches_per_date_loop():
+    closes, baskets = synthetic_closes(200, 10, gap_fraction=0.05, seed=1)
+    variants = calculate_asi_variants(closes, baskets, [ASIVariant('cum', performance_window=14, method='cumulative')])
+    pw = 14
+    expected = {}
+    for date in closes.index[closes.index >= closes.index[0] + timedelta(days=pw - 1)]:
+        window = closes.loc[date - timedelta(days=pw):date]
+        growth = (1 + window.ffill().pct_change(fill_method=None)).prod(min_count=1)
+        valid = window.notna().any()
+        expected[date] = float((valid[1:] & (growth[1:] > growth[BTC_TICKER])).sum())
+    result = variants.set_index('date')['outperforming_count']
+    assert result.to_dict() == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('freq', ['h', 'D'])
+def test_sharded_asi_is_identical_to_single_process(freq):
+    closes, baskets = synthetic_closes(6000 if freq == 'h' else 900, 15, gap_fraction=0.03, seed=2, freq=freq)
+    # Date mancanti: l'indice non è regolare
+    closes = closes.drop(closes.index[1000:1200])
+    single = calculate_full_asi(closes, baskets, performance_window=30)
+    sharded = calculate_full_asi(closes, baskets, performance_window=30, n_jobs=2, shard_size=500)
+    pd.testing.assert_frame_equal(sharded, single, check_freq=False)
+
+
+def test_sharded_asi_on_empty_index_returns_empty_frame():
+    closes, baskets = synthetic_closes(50, 3, gap_fraction=0.0)
+    empty = closes.iloc[:0]
+    single = calculate_full_asi(empty, baskets, performance_window=30)
+    sharded = calculate_full_asi(empty, baskets, performance_window=30, n_jobs=2)
+    pd.testing.assert_frame_equal(sharded, single)
+    assert sharded.empty
@@ -0,0 +1,71 @@
+# tests/test_backtest.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.asi_indicator_calculator import ASI_REGIME_LABELS, RSI_PHASE_LABELS, SLOPE_PHASE_LABELS
+from src.backtest import BACKTEST_ASSETS, run_backtest
+from src.rule_engine import TS1_RULES, TS2_RULES, boost_level
+
+
+def synthetic_inputs(n_rows=500, seed=0):
+    """Fasi casuali (con buchi, anche all'inizio) e rendimenti con date mancanti per asset."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2022-01-01', periods=n_rows, freq='D', name='date')
+    indicators = pd.DataFrame({
+        'asi_regime': rng.choice(ASI_REGIME_LABELS, n_rows),
+        'rsi_phase': rng.choice(RSI_PHASE_LABELS, n_rows),
+        'slope_phase': rng.choice(SLOPE_PHASE_LABELS, n_rows),
+    }, index=index)
+    indicators.iloc[:20, 1] = None
+    indicators = indicators.mask(rng.random(indicators.shape) < 0.05)
+    returns = pd.DataFrame(rng.normal(0.001, 0.03, (n_rows, len(BACKTEST_ASSETS))), index=index, columns=list(BACKTEST_ASSETS))
+    returns = returns.mask(rng.random(returns.shape) < 0.05)
+    return indicators, returns
+
+
+def reference_backtest(indicators, returns, rules, deploy_freq):
+    """Ciclo per data: V_t = V_(t-1) * (1 + r_t) + versamento_t, capitale fermo dove r_t manca."""
+    complete = indicators.notna().all(axis=1)
+    first = complete.index[complete.to_numpy().argmax()]
+    dates = indicators.index[indicators.index >= first]
+    deploy_dates = set(pd.date_range(first, dates[-1], freq=deploy_freq))
+    values = {asset: [] for asset in BACKTEST_ASSETS}
+    invested = []
+    value = dict.fromkeys(BACKTEST_ASSETS, 0.0)
+    total = 0.0
+    for date in dates:
+        amount = 0.0
+        if date in deploy_dates and complete[date]:
+            phases = tuple(indicators.loc[date, ['asi_regime', 'rsi_phase', 'slope_phase']])
+            amount = float(rules.amounts[boost_level(rules, phases)])
+        total += amount
+        invested.append(total)
+        for asset in BACKTEST_ASSETS:
+            r = returns.loc[date, asset]
+            value[asset] = value[asset] * (1 + (0.0 if np.isnan(r) else r)) + amount
+            values[asset].append(value[asset])
+    return pd.DataFrame(values, index=dates), pd.Series(invested, index=dates)
+
+
+@pytest.mark.parametrize('deploy_freq', ['7D', '30D'])
+def test_backtest_matches_per_date_loop(deploy_freq):
+    indicators, returns = synthetic_inputs()
+    result = run_backtest(indicators, returns, [TS1_RULES, TS2_RULES], deploy_freq=deploy_freq)
+
+    for rules in (TS1_RULES, TS2_RULES):
+        expected_values, expected_invested = reference_backtest(indicators, returns, rules, deploy_freq)
+        np.testing.assert_allclose(result.equity[rules.name].to_numpy(), expected_values.to_numpy(), rtol=1e-9)
+        np.testing.assert_allclose(result.invested[rules.name].to_numpy(), expected_invested.to_numpy())
+        summary = result.summary[result.summary['variant'] == rules.name].set_index('asset')
+        np.testing.assert_allclose(summary.loc[list(BACKTEST_ASSETS), 'final_value'], expected_values.iloc[-1], rtol=1e-9)
+        assert (summary['invested'] == expected_invested.iloc[-1]).all()
+
+
+def test_parallel_backtest_is_identical_to_single_process():
+    indicators, returns = synthetic_inputs(seed=1)
+    single = run_backtest(indicators, returns, [TS1_RULES, TS2_RULES])
+    parallel = run_backtest(indicators, returns, [TS1_RULES, TS2_RULES], n_jobs=2)
+    pd.testing.assert_frame_equal(parallel.equity, single.equity)
+    pd.testing.assert_frame_equal(parallel.summary, single.summary)
@@ -0,0 +1,74 @@
+# tests/test_normalization.py
+
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.normalization import (concat_bars, normalize_bar_frame, normalize_eod_json, normalize_parquet_bytes,
+                               to_bar_frame)
+
+
+def reference_bars(records):
+    """Percorso pandas originale: adjusted_close se presente, NaN scartati, ultima barra per data."""
+    df = pd.DataFrame(records)
+    close = 'adjusted_close' if 'adjusted_close' in df.columns and df['adjusted_close'].notna().any() else 'close'
+    df = df.rename(columns={close: 'price'})[['date', 'price', 'volume']].rename(columns={'price': 'close'})
+    df['date'] = pd.to_datetime(df['date'].str[:10])
+    df = df.dropna().drop_duplicates(subset='date', keep='last').sort_values('date', kind='stable').reset_index(drop=True)
+    return df.astype({'date': 'datetime64[ns]', 'close': 'float32', 'volume': 'float64'})
+
+
+def test_adjusted_close_is_preferred_over_close():
+    payload = b'[{"date":"2024-01-01","close":1.0,"adjusted_close":2.0,"volume":10},' \
+              b'{"date":"2024-01-02","close":1.5,"adjusted_close":2.5,"volume":20}]'
+    bars = to_bar_frame(normalize_eod_json(payload))
+    assert bars['close'].tolist() == [2.0, 2.5]
+
+
+def test_close_is_used_when_adjusted_close_is_missing_or_null():
+    records = [{"date": "2024-01-01", "close": 1.0, "adjusted_close": None, "volume": 10},
+               {"date": "2024-01-02", "close": 1.5, "adjusted_close": None, "volume": 20}]
+    payload = pd.Series(records).to_json(orient='records').encode()
+    pd.testing.assert_frame_equal(to_bar_frame(normalize_eod_json(payload)), reference_bars(records))
+    without_column = b'[{"date":"2024-01-01","close":3.0,"volume":1}]'
+    assert to_bar_frame(normalize_eod_json(without_column))['close'].tolist() == [3.0]
+
+
+def test_duplicate_dates_unsorted_input_and_nan_rows():
+    records = [{"date": "2024-01-03", "close": 3.0, "volume": 3.0},
+               {"date": "2024-01-01", "close": 1.0, "volume": 1.0},
+               {"date": "2024-01-03 00:00:00", "close": 30.0, "volume": 30.0},
+               {"date": "2024-01-02", "close": None, "volume": 2.0},
+               {"date": "2024-01-01", "close": 10.0, "volume": 10.0}]
+    # JSON con spazi tra i record: passa dal separatore a regex
+    payload = ('[ ' + ' ,\n '.join(pd.Series([record]).to_json(orient='records')[1:-1] for record in records) + ' ]').encode()
+    bars = to_bar_frame(normalize_eod_json(payload))
+    pd.testing.assert_frame_equal(bars, reference_bars(records))
+    assert bars['close'].tolist() == [10.0, 30.0]
+
+
+def test_empty_array_returns_empty_frame():
+    bars = to_bar_frame(normalize_eod_json(b' [ ] '))
+    assert bars.empty
+    assert list(bars.columns) == ['date', 'close', 'volume']
+
+
+@pytest.mark.parametrize('payload', [b'{"error":"Ticker not found"}', b'not json', b'[{"date":"2024-01-01","volume":1}]',
+                                     b'[{"close":1.0,"volume":1}]', b'[{"date":"2024-01-01","close":1.0}]'])
+def test_invalid_payloads_raise_value_error(payload):
+    with pytest.raises(ValueError):
+        normalize_eod_json(payload)
+
+
+def test_parquet_round_trip_and_concat_prefers_later_table():
+    stored = pd.DataFrame({'date': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-02']),
+                           'close': np.array([1.0, 2.0, 2.5], dtype=np.float32), 'volume': [1.0, 2.0, 2.5]})
+    buffer = io.BytesIO()
+    stored.to_parquet(buffer, index=False)
+    delta = pd.DataFrame({'date': pd.to_datetime(['2024-01-02', '2024-01-03']), 'close': [9.0, 3.0], 'volume': [9.0, 3.0]})
+
+    bars = to_bar_frame(concat_bars(normalize_parquet_bytes(buffer.getvalue()), normalize_bar_frame(delta)))
+    assert bars['date'].dt.strftime('%Y-%m-%d').tolist() == ['2024-01-01', '2024-01-02', '2024-01-03']
+    assert bars['close'].tolist() == [1.0, 9.0, 3.0]
@@ -0,0 +1,57 @@
+# tests/test_streaming_aggregation.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing import BTC_TICKER, extend_basket_history, rebalance_schedule
+from src.streaming_aggregation import StreamingBasketAggregator, stream_historical_data
+
+
+def synthetic_history(n_rows=700, n_alts=80, seed=0):
+    """Storico in formato lungo (indice date, colonne ticker, close, volume) con quotazioni e delisting sfalsati."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2018-03-01', periods=n_rows, freq='D', name='date')
+    columns = [BTC_TICKER] + [f'ALT{i}-USD.CC' for i in range(n_alts)]
+    closes = pd.DataFrame(np.exp(np.cumsum(rng.normal(0, 0.03, (n_rows, len(columns))), axis=0)), index=index, columns=columns)
+    for column in columns[1:]:
+        closes.loc[closes.index[:rng.integers(0, n_rows)], column] = np.nan
+        if rng.random() < 0.2:
+            closes.loc[closes.index[rng.integers(0, n_rows):], column] = np.nan
+    volumes = pd.DataFrame(rng.lognormal(10, 2, closes.shape), index=index, columns=columns).where(closes.notna())
+    long = pd.concat({'close': closes.stack(), 'volume': volumes.stack()}, axis=1).reset_index(level=1)
+    return closes, long.rename(columns={'level_1': 'ticker'})
+
+
+def ticker_frames(long):
+    return ((ticker, group.drop(columns='ticker')) for ticker, group in long.groupby('ticker'))
+
+
+@pytest.mark.parametrize('memory_budget_mb', [100, 0.01])
+def test_streaming_matches_in_memory_baskets_and_closes(memory_budget_mb):
+    closes, long = synthetic_history()
+    expected = extend_basket_history(long, top_n=20)
+    rebalance_dates = rebalance_schedule(long.index.min(), long.index.max())
+
+    streamed_closes, streamed = stream_historical_data(ticker_frames(long), rebalance_dates, top_n=20,
+                                                       memory_budget_mb=memory_budget_mb)
+
+    pd.testing.assert_frame_equal(streamed, expected.reset_index(drop=True), check_dtype=False)
+    assert set(expected['ticker']) | {BTC_TICKER} <= set(streamed_closes.columns)
+    for ticker in streamed_closes.columns:
+        pd.testing.assert_series_equal(streamed_closes[ticker].dropna(), closes[ticker].dropna(),
+                                       check_names=False, check_freq=False, check_index_type=False)
+
+
+def test_tiny_budget_spills_closes_to_disk():
+    _, long = synthetic_history(n_rows=400, n_alts=30, seed=1)
+    aggregator = StreamingBasketAggregator(rebalance_schedule(long.index.min(), long.index.max()), top_n=10,
+                                           memory_budget_mb=0.01)
+    try:
+        for ticker, frame in ticker_frames(long):
+            aggregator.add(ticker, frame)
+        closes = aggregator.closes()
+        assert aggregator._spilled_files > 0
+        assert set(aggregator.basket_history()['ticker']) <= set(closes.columns)
+    finally:
+        aggregator.close()